@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for the flathub_mapper pipeline.
+
+Generates a synthetic AppStream catalog and a synthetic nix search dump at
+the requested scale, then times each pipeline stage separately. Results are
+written as JSON so runs can be compared.
+
+Usage:
+    python benchmarks/bench_mapper.py --components 5000 --attributes 100000 -o new.json
+    python benchmarks/bench_mapper.py --compare old.json new.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import flathub_mapper  # noqa: E402
+from synthetic import write_appstream_catalog, write_nix_search_json  # noqa: E402
+
+RESULT_FORMAT = 1
+
+
+def time_stage(func: Callable[[], object], repeat: int) -> dict:
+    """Run func repeat times with stdout silenced and summarize wall times."""
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return {
+        "best": round(min(times), 5),
+        "mean": round(statistics.fmean(times), 5),
+        "runs": repeat,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def run_suite(components: int, attributes: int, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        catalog = write_appstream_catalog(tmp_dir / "appstream.xml.gz", components)
+        search_json = write_nix_search_json(tmp_dir / "search.json", attributes, components)
+
+        with open(search_json) as f:
+            nixpkgs_packages = flathub_mapper.read_nix_search_json(f)
+        with contextlib.redirect_stdout(io.StringIO()):
+            flathub_components = flathub_mapper.parse_flathub_appstream(catalog)
+            mappings = flathub_mapper.create_mapping(flathub_components, nixpkgs_packages, {})
+        pairs = [(flathub_components[m.flathub_id], m) for m in mappings]
+        output_dir = tmp_dir / "out"
+        output_dir.mkdir()
+
+        def ingest_nix_search():
+            with open(search_json) as f:
+                flathub_mapper.read_nix_search_json(f)
+
+        def transform_all():
+            for component, mapping in pairs:
+                flathub_mapper.transform_component_xml(component, mapping, output_dir)
+
+        stages = {
+            "read_nix_search_json": ingest_nix_search,
+            "parse_flathub_appstream": lambda: flathub_mapper.parse_flathub_appstream(catalog),
+            "create_mapping": lambda: flathub_mapper.create_mapping(flathub_components, nixpkgs_packages, {}),
+            "transform_component_xml": transform_all,
+            "generate_appstream_catalog": lambda: flathub_mapper.generate_appstream_catalog(
+                mappings, flathub_components, output_dir, download_icons=False
+            ),
+            "generate_mapping_report": lambda: flathub_mapper.generate_mapping_report(
+                mappings, flathub_components, output_dir
+            ),
+        }
+        results = {name: time_stage(func, repeat) for name, func in stages.items()}
+
+    return {
+        "format": RESULT_FORMAT,
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "params": {
+            "components": components,
+            "attributes": attributes,
+            "mappings": len(mappings),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def print_results(run: dict) -> None:
+    params = run["params"]
+    print(f"{params['components']} components, {params['attributes']} attributes, "
+          f"{params['mappings']} mappings (best of {params['repeat']})")
+    for name, result in run["results"].items():
+        print(f"  {name:28} {result['best'] * 1000:10.1f} ms")
+
+
+def compare(old_path: Path, new_path: Path) -> None:
+    """Print per-stage best times of two result files side by side."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old["params"] != new["params"]:
+        print(f"Warning: parameters differ: {old['params']} vs {new['params']}")
+
+    print(f"{'stage':28} {'old ms':>10} {'new ms':>10} {'change':>8}")
+    for name in dict.fromkeys([*old["results"], *new["results"]]):
+        before = old["results"].get(name, {}).get("best")
+        after = new["results"].get(name, {}).get("best")
+        if before is None or after is None:
+            print(f"{name:28} {'-' if before is None else f'{before * 1000:10.1f}':>10} "
+                  f"{'-' if after is None else f'{after * 1000:10.1f}':>10}")
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{name:28} {before * 1000:10.1f} {after * 1000:10.1f} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the flathub_mapper pipeline offline")
+    parser.add_argument("--components", type=int, default=2000, help="Synthetic Flathub apps")
+    parser.add_argument("--attributes", type=int, default=20000, help="Synthetic nixpkgs attributes")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the best is reported")
+    parser.add_argument("--output", "-o", type=Path, help="Write results as JSON")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"), help="Compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    run = run_suite(args.components, args.attributes, args.repeat)
+    print_results(run)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
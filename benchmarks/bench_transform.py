@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark component transformation against the old raw_xml round-trips.
+
+Before, every mapped component went through three XML codec passes:
+ET.tostring during parsing, ET.fromstring + ET.tostring in
+transform_component_xml, and ET.fromstring again in
+generate_appstream_catalog. Now parsing keeps each component's source
+bytes without re-serializing them, and transform_component_xml parses
+them once. This compares the two on a synthetic catalog; the old pipeline
+starts from the element trees it used to keep, the current one from the
+stored bytes.
+
+Usage:
+    python benchmarks/bench_transform.py --components 5000
+"""
+
+import argparse
+import sys
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import flathub_mapper  # noqa: E402
+from synthetic import synthetic_component  # noqa: E402
+
+
+def legacy_transform(raw_xml: str, mapping: flathub_mapper.Mapping, comp_id: str) -> str:
+    """The former string-based transform_component_xml."""
+    elem = ET.fromstring(raw_xml)
+    pkgname = elem.find("pkgname")
+    if pkgname is None:
+        pkgname = ET.SubElement(elem, "pkgname")
+    pkgname.text = mapping.nixpkgs_attr
+    releases = elem.find("releases")
+    if releases is None:
+        releases = ET.SubElement(elem, "releases")
+    releases.clear()
+    ET.SubElement(releases, "release").set("version", mapping.nixpkgs_version)
+    for icon in elem.findall("icon"):
+        if icon.get("type", "") in ("remote", "cached"):
+            icon.set("type", "cached")
+            icon.set("width", "128")
+            icon.set("height", "128")
+            icon.text = f"{comp_id}.png"
+    return ET.tostring(elem, encoding="unicode")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--components", type=int, default=5000)
+    args = parser.parse_args()
+
+    sources = [ET.tostring(synthetic_component(i)) for i in range(args.components)]
+    elements = [ET.fromstring(xml) for xml in sources]
+    components = [flathub_mapper._component_from_element(ET.fromstring(xml), xml=xml) for xml in sources]
+    mappings = [
+        flathub_mapper.Mapping(c.id, f"app{i}", "1.0", 1.0) for i, c in enumerate(components)
+    ]
+    output_dir = Path(".")
+
+    start = time.perf_counter()
+    root = ET.Element("components")
+    for c, e, m in zip(components, elements, mappings):
+        raw_xml = ET.tostring(e, encoding="unicode")
+        root.append(ET.fromstring(legacy_transform(raw_xml, m, c.id)))
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    root = ET.Element("components")
+    for c, m in zip(components, mappings):
+        root.append(flathub_mapper.transform_component_xml(c, m, output_dir))
+    current = time.perf_counter() - start
+
+    print(f"components:        {args.components}")
+    print(f"raw_xml round-trip: {legacy * 1000:8.1f} ms")
+    print(f"lazy single parse:  {current * 1000:8.1f} ms")
+    print(f"speedup:            {legacy / current:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Synthetic inputs for the mapper benchmarks.
+
+Everything is generated deterministically from a seed, so two benchmark
+runs at the same scale process identical data.
+"""
+
+import gzip
+import json
+import random
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+LANGUAGES = ("de", "fr", "es", "it", "ja", "pt_BR", "ru", "zh_CN")
+VENDORS = ("org.gnome", "org.kde", "io.github.someone", "com.example", "net.sourceforge")
+WORDS = ("text", "editor", "photo", "music", "player", "studio", "notes", "chat", "mail", "paint",
+         "video", "terminal", "browser", "reader", "draw", "maps", "clock", "weather", "files", "code")
+
+
+def app_words(i: int) -> list[str]:
+    """Two words naming synthetic app i, e.g. ["text", "editor"]."""
+    return [WORDS[i % len(WORDS)], WORDS[(i // len(WORDS)) % len(WORDS)], str(i)]
+
+
+def component_id(i: int) -> str:
+    """Reverse-DNS ID of synthetic app i, e.g. "org.gnome.TextEditor7"."""
+    vendor = VENDORS[i % len(VENDORS)]
+    return f"{vendor}.{''.join(w.capitalize() for w in app_words(i))}"
+
+
+def synthetic_component(i: int) -> ET.Element:
+    """Build a Flathub-like <component> with translations, screenshots and releases."""
+    words = app_words(i)
+    comp = ET.Element("component", type="desktop-application")
+    ET.SubElement(comp, "id").text = component_id(i)
+    ET.SubElement(comp, "name").text = " ".join(w.capitalize() for w in words)
+    ET.SubElement(comp, "summary").text = f"A {words[0]} {words[1]} application"
+    for lang in LANGUAGES:
+        ET.SubElement(comp, "name", {"xml:lang": lang}).text = f"{words[0]} {words[1]} ({lang})"
+        ET.SubElement(comp, "summary", {"xml:lang": lang}).text = f"Summary in {lang}"
+    desc = ET.SubElement(comp, "description")
+    for p in range(4):
+        ET.SubElement(desc, "p").text = f"Paragraph {p} describing app {i}. " * 3
+    ET.SubElement(comp, "icon", type="cached", width="128", height="128").text = f"{component_id(i)}.png"
+    cats = ET.SubElement(comp, "categories")
+    ET.SubElement(cats, "category").text = "Utility"
+    keywords = ET.SubElement(comp, "keywords")
+    for word in words[:2]:
+        ET.SubElement(keywords, "keyword").text = word
+    ET.SubElement(comp, "url", type="homepage").text = f"https://example.org/{'-'.join(words)}"
+    ET.SubElement(comp, "project_license").text = ("GPL-3.0-or-later", "MIT", "Apache-2.0")[i % 3]
+    ET.SubElement(comp, "developer_name").text = "Example Developers"
+    ET.SubElement(comp, "launchable", type="desktop-id").text = f"{component_id(i)}.desktop"
+    shots = ET.SubElement(comp, "screenshots")
+    for s in range(3):
+        shot = ET.SubElement(shots, "screenshot")
+        ET.SubElement(shot, "image", type="source").text = f"https://example.org/{i}/{s}.png"
+    releases = ET.SubElement(comp, "releases")
+    for r in range(5):
+        ET.SubElement(releases, "release", version=f"{i % 7}.{5 - r}", timestamp=str(1_600_000_000 - r))
+    return comp
+
+
+def write_appstream_catalog(path: Path, components: int) -> Path:
+    """Write a gzipped Flathub-style catalog with the given number of apps."""
+    root = ET.Element("components", version="0.8", origin="flathub")
+    for i in range(components):
+        root.append(synthetic_component(i))
+        # Runtimes and other non-apps are skipped by the parser but still cost time
+        if i % 10 == 0:
+            runtime = ET.SubElement(root, "component", type="runtime")
+            ET.SubElement(runtime, "id").text = f"org.example.Platform{i}"
+    ET.indent(root, space="  ")
+    with gzip.GzipFile(path, "wb", mtime=0) as f:
+        ET.ElementTree(root).write(f, encoding="utf-8", xml_declaration=True)
+    return path
+
+
+def write_nix_search_json(path: Path, attributes: int, components: int, seed: int = 0) -> Path:
+    """
+    Write `nix search --json`-style output with the given number of attributes.
+
+    Roughly half of the first components apps get a matching attribute (in
+    a mix of exact, separator-variant and nested spellings); the rest are
+    random filler.
+    """
+    rng = random.Random(seed)
+    results = {}
+
+    def add(attr: str, pname: str, version: str) -> None:
+        results[f"legacyPackages.x86_64-linux.{attr}"] = {
+            "pname": pname,
+            "version": version,
+            "description": f"Synthetic package {pname}",
+        }
+
+    for i in range(0, components, 2):
+        words = app_words(i)
+        style = i % 3
+        if style == 0:
+            attr = "-".join(words)
+        elif style == 1:
+            attr = "".join(words)
+        else:
+            attr = f"{VENDORS[i % len(VENDORS)].split('.')[-1]}Packages.{'-'.join(words)}"
+        add(attr, "-".join(words), f"{i % 7}.5")
+
+    alphabet = "abcdefghijklmnopqrstuvwxyz"
+    while len(results) < attributes:
+        name = "".join(rng.choice(alphabet) for _ in range(rng.randint(3, 8)))
+        name += "-" + "".join(rng.choice(alphabet) for _ in range(rng.randint(2, 6)))
+        prefix = rng.choice(("", "", "", "python3Packages.", "haskellPackages.", "perlPackages."))
+        add(prefix + name, name, f"{rng.randint(0, 9)}.{rng.randint(0, 20)}")
+
+    with open(path, "w") as f:
+        json.dump(results, f)
+    return path
@@ -52,6 +52,8 @@
                     cargo
                     openssl
                     pkgconfig
+                    brotli
+                    (python3.withPackages (ps: with ps; [ brotli pytest ]))
                 ];
             };
           };
@@ -12,19 +12,68 @@ Usage:
 """
 
 import argparse
+import base64
+import cProfile
 import gzip
+import hashlib
+import http.client
+import io
 import json
+import math
+import multiprocessing
+import os
+import pickle
+import re
+import resource
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+import tracemalloc
+import urllib.error
+import urllib.parse
 import urllib.request
 import xml.etree.ElementTree as ET
-from dataclasses import dataclass, field
+from collections import Counter, defaultdict
+from collections.abc import Callable, Container, Hashable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass, field, fields, replace
 from pathlib import Path
+from typing import IO, Any, BinaryIO
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
 
-# Flathub AppStream data URLs
-FLATHUB_APPSTREAM_URL = "https://dl.flathub.org/repo/appstream/x86_64/appstream.xml.gz"
-FLATHUB_ICONS_BASE_URL = "https://dl.flathub.org/repo/appstream/x86_64/icons"
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Flathub AppStream data URLs, per architecture
+FLATHUB_APPSTREAM_URL = "https://dl.flathub.org/repo/appstream/{arch}/appstream.xml.gz"
+FLATHUB_ICONS_BASE_URL = "https://dl.flathub.org/repo/appstream/{arch}/icons"
+FLATHUB_BETA_APPSTREAM_URL = "https://dl.flathub.org/beta-repo/appstream/{arch}/appstream.xml.gz"
+FLATHUB_BETA_ICONS_BASE_URL = "https://dl.flathub.org/beta-repo/appstream/{arch}/icons"
+DEFAULT_ARCH = "x86_64"
+
+# ElementTree's name for the xml:lang attribute of translated fields
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+# Per-package customisation file shared with the Rust generator
+CUSTOM_DATA_FILE = "custom.json"
+
+# Bump when the cached component records change meaning; a change of
+# FlathubComponent's fields invalidates them on its own
+COMPONENT_CACHE_FORMAT = 6
+
+# Bump when the cached nix search package table changes shape or keys
+NIX_SEARCH_CACHE_FORMAT = 2
+
+# Bump when transform_component_xml or CatalogWriter output changes, so cached
+# catalog fragments from earlier runs are not reused
+FRAGMENT_FORMAT = 3
 
 
 @dataclass
@@ -35,6 +84,10 @@ class NixPackage:
     version: str
     desktop_ids: list[str] = field(default_factory=list)  # e.g., ["org.mozilla.firefox.desktop"]
     store_path: str | None = None
+    homepage: str | None = None  # meta.homepage
+    license: str | None = None  # meta.license, SPDX ID where available
+    pname: str | None = None  # e.g., "firefox"; with version, names the store path
+    main_program: str | None = None  # meta.mainProgram
 
 
 @dataclass
@@ -52,7 +105,68 @@ class FlathubComponent:
     homepage: str | None
     license: str | None
     developer_name: str | None
-    raw_xml: str  # Original XML for transformation
+    xml: bytes  # Source <component> XML, parsed again only for transformation
+    version: str | None = None  # Latest <release> version
+    launchables: list[str] = field(default_factory=list)  # desktop-id launchables
+    xml_hash: str = ""  # SHA-256 of the source <component> XML
+
+    def parse_element(self) -> ET.Element:
+        """Build the <component> element; only mapped components need it."""
+        return ET.fromstring(self.xml)
+
+
+@dataclass
+class AppStreamSource:
+    """An AppStream catalog that contributes components to the merged set."""
+
+    name: str  # e.g., "flathub"; also names the source's cache files
+    location: str  # URL, catalog file or metainfo directory; may contain {arch}
+    icons_base_url: str | None = None  # base URL for cached icons; may contain {arch}
+    priority: int = 0  # higher wins when sources share a component ID
+
+    @property
+    def is_remote(self) -> bool:
+        return urllib.parse.urlsplit(self.location).scheme in ("http", "https")
+
+    def arch_suffix(self, arch: str) -> str:
+        """Cache file suffix; sources without {arch} are shared by every architecture."""
+        return f"-{arch}" if "{arch}" in self.location else ""
+
+    def icons_url(self, arch: str) -> str | None:
+        return self.icons_base_url.format(arch=arch) if self.icons_base_url else None
+
+    def fetch(self, cache_dir: Path, max_age_hours: float = 24.0, arch: str = DEFAULT_ARCH) -> Path:
+        """
+        Make the source's catalog for arch available locally.
+
+        Remote catalogs go through download_cached; local files and
+        directories are used in place.
+
+        Returns:
+            Path to the catalog file or metainfo directory.
+        """
+        location = self.location.format(arch=arch)
+        if not self.is_remote:
+            path = Path(location).expanduser()
+            if not path.exists():
+                raise FileNotFoundError(f"AppStream source {self.name} not found: {path}")
+            return path
+
+        suffix = ".xml.gz" if location.endswith(".gz") else ".xml"
+        dest = cache_dir / f"{self.name}-appstream{self.arch_suffix(arch)}{suffix}"
+        return download_cached(location, dest, max_age_hours)
+
+
+FLATHUB_SOURCE = AppStreamSource("flathub", FLATHUB_APPSTREAM_URL, FLATHUB_ICONS_BASE_URL)
+
+# Sources that can be named on the command line without a location
+KNOWN_SOURCES = {
+    source.name: source
+    for source in (
+        FLATHUB_SOURCE,
+        AppStreamSource("flathub-beta", FLATHUB_BETA_APPSTREAM_URL, FLATHUB_BETA_ICONS_BASE_URL),
+    )
+}
 
 
 @dataclass
@@ -65,36 +179,401 @@ class Mapping:
     confidence: float  # 0.0 to 1.0
 
 
-def fetch_flathub_appstream(cache_dir: Path) -> Path:
+def download_cached(url: str, dest: Path, max_age_hours: float = 24.0) -> Path:
     """
-    Download and cache the Flathub AppStream data.
+    Download a URL into a cache file, revalidating with the server when stale.
+
+    Validators (ETag / Last-Modified) from the last download are kept in a
+    JSON sidecar next to the file. Once the cache is older than
+    max_age_hours, a conditional request is sent, so an unchanged resource
+    costs a single 304 round-trip instead of a full transfer. If the
+    server cannot be reached or answers with an error, a stale copy of the
+    same URL is used instead. A cache downloaded from a different URL is
+    never reused.
 
     Returns:
-        Path to the decompressed XML file.
+        Path to the cached file.
     """
-    cache_dir.mkdir(parents=True, exist_ok=True)
-    gz_path = cache_dir / "flathub-appstream.xml.gz"
-    xml_path = cache_dir / "flathub-appstream.xml"
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    meta_path = dest.with_name(dest.name + ".meta.json")
+
+    meta = {}
+    have_cache = dest.exists()
+    if have_cache and meta_path.exists():
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            meta = {}
+        if meta.get("url") != url:
+            # The cached file belongs to another URL; ignore it entirely
+            meta = {}
+            have_cache = False
+
+    if have_cache:
+        checked_at = meta.get("checked_at", dest.stat().st_mtime)
+        age_hours = (time.time() - checked_at) / 3600
+        if age_hours < max_age_hours:
+            print(f"Using cached {dest.name} ({age_hours:.1f} hours old)")
+            return dest
+
+    request = urllib.request.Request(url)
+    if have_cache:
+        if meta.get("etag"):
+            request.add_header("If-None-Match", meta["etag"])
+        if meta.get("last_modified"):
+            request.add_header("If-Modified-Since", meta["last_modified"])
+
+    print(f"Downloading {url}...")
+    tmp_path = dest.with_name(dest.name + ".part")
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            with open(tmp_path, "wb") as f_out:
+                shutil.copyfileobj(response, f_out)
+            headers = response.headers
+    except urllib.error.HTTPError as e:
+        tmp_path.unlink(missing_ok=True)
+        if not have_cache:
+            raise
+        if e.code != 304:
+            print(f"Warning: Failed to revalidate {dest.name}, using stale cache: {e}")
+            return dest
+        print(f"{dest.name} is unchanged upstream")
+        meta["checked_at"] = time.time()
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        return dest
+    except (urllib.error.URLError, OSError) as e:
+        tmp_path.unlink(missing_ok=True)
+        if not have_cache:
+            raise
+        print(f"Warning: Failed to revalidate {dest.name}, using stale cache: {e}")
+        return dest
+
+    tmp_path.replace(dest)
+    meta = {
+        "url": url,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "checked_at": time.time(),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+
+    return dest
+
+
+def fetch_flathub_appstream(cache_dir: Path, max_age_hours: float = 24.0, arch: str = DEFAULT_ARCH) -> Path:
+    """
+    Download and cache the Flathub AppStream data for one architecture.
+
+    The catalog is kept compressed; parsing streams it through gzip directly.
+
+    Returns:
+        Path to the compressed XML file.
+    """
+    return FLATHUB_SOURCE.fetch(cache_dir, max_age_hours, arch)
+
+
+def fetch_sources(
+    sources: list[AppStreamSource], arches: list[str], cache_dir: Path, max_age_hours: float = 24.0
+) -> dict[tuple[str, str], Path]:
+    """
+    Fetch every source's catalog for every architecture concurrently.
+
+    Returns:
+        Dict mapping (source name, architecture) to the local catalog path.
+    """
+    jobs = [(source, arch) for source in sources for arch in arches]
+    with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as executor:
+        futures = {
+            (source.name, arch): executor.submit(source.fetch, cache_dir, max_age_hours, arch)
+            for source, arch in jobs
+        }
+        return {key: future.result() for key, future in futures.items()}
+
+
+def parse_source_spec(spec: str) -> AppStreamSource:
+    """
+    Parse a --source argument: a known source name, or NAME=LOCATION with
+    an optional ",ICONS_URL" that resolves the catalog's cached icons.
+
+    Returns:
+        The described AppStreamSource.
+    """
+    name, sep, location = spec.partition("=")
+    if not re.fullmatch(r"[\w.-]+", name):
+        raise argparse.ArgumentTypeError(f"invalid source name: {name!r}")
+    if not sep:
+        if name not in KNOWN_SOURCES:
+            known = ", ".join(KNOWN_SOURCES)
+            raise argparse.ArgumentTypeError(f"unknown source {name!r} (known: {known}); use NAME=LOCATION")
+        return KNOWN_SOURCES[name]
+    location, _, icons_base_url = location.partition(",")
+    return AppStreamSource(name, location, icons_base_url.rstrip("/") or None)
+
+
+def open_appstream(xml_path: Path) -> BinaryIO:
+    """Open an AppStream catalog, decompressing on the fly if it is gzipped."""
+    if xml_path.suffix == ".gz":
+        return gzip.open(xml_path, "rb")
+    return open(xml_path, "rb")
+
+
+def _component_from_element(
+    component: ET.Element,
+    icons_base_url: str | None = FLATHUB_ICONS_BASE_URL.format(arch=DEFAULT_ARCH),
+    xml: bytes | None = None,
+) -> FlathubComponent | None:
+    """
+    Extract a FlathubComponent from a parsed <component> element.
+
+    xml is the source the element was parsed from; it is kept (and hashed)
+    as is, so only elements without one are serialized again.
+
+    Returns:
+        The component, or None if it is not a desktop application.
+    """
+    comp_type = component.get("type", "")
+    if comp_type not in DESKTOP_TYPES:
+        return None
+
+    comp_id = component.findtext("id", "").strip()
+    if not comp_id:
+        return None
+
+    # Remove .desktop suffix if present for the ID
+    base_id = comp_id.removesuffix(".desktop")
+
+    name = component.findtext("name", "")
+    summary = component.findtext("summary", "")
+
+    # Get description (may have <p> tags)
+    desc_elem = component.find("description")
+    description = ""
+    if desc_elem is not None:
+        # Concatenate all text content
+        description = "".join(desc_elem.itertext()).strip()
+
+    # Categories
+    categories = []
+    for cat in component.findall(".//category"):
+        if cat.text:
+            categories.append(cat.text)
+
+    # Keywords
+    keywords = []
+    for kw in component.findall(".//keyword"):
+        if kw.text:
+            keywords.append(kw.text)
+
+    # Screenshots
+    screenshots = []
+    for screenshot in component.findall(".//screenshot/image"):
+        if screenshot.text and screenshot.get("type") == "source":
+            screenshots.append(screenshot.text)
+
+    # Icon
+    icon_url = None
+    for icon in component.findall("icon"):
+        if icon.get("type") == "remote" and icon.text:
+            icon_url = icon.text
+            break
+        elif icon.get("type") == "cached" and icon.text and icons_base_url:
+            # Build URL from cached icon
+            icon_url = f"{icons_base_url}/128x128/{icon.text}"
+            break
+
+    # Other metadata
+    homepage = None
+    for url in component.findall("url"):
+        if url.get("type") == "homepage":
+            homepage = url.text
+            break
+
+    license_id = component.findtext("project_license", "")
+    developer_name = component.findtext("developer_name", "")
+
+    # Latest release (releases are listed newest first)
+    release = component.find("releases/release")
+    version = release.get("version") if release is not None else None
+
+    launchables = [
+        launchable.text.strip()
+        for launchable in component.findall("launchable")
+        if launchable.get("type") == "desktop-id" and launchable.text
+    ]
+
+    # Keep the compact source bytes rather than the element tree; the tree
+    # is rebuilt for the few components that are transformed
+    if xml is None:
+        component.tail = None
+        xml = ET.tostring(component)
+    xml_hash = hashlib.sha256(xml).hexdigest()
+
+    return FlathubComponent(
+        id=base_id,
+        name=name,
+        summary=summary,
+        description=description,
+        categories=categories,
+        keywords=keywords,
+        screenshots=screenshots,
+        icon_url=icon_url,
+        homepage=homepage,
+        license=license_id,
+        developer_name=developer_name,
+        xml=xml,
+        version=version,
+        launchables=launchables,
+        xml_hash=xml_hash,
+    )
+
+
+def iter_metainfo_dir(
+    metainfo_dir: Path, icons_base_url: str | None = None
+) -> Iterator[FlathubComponent]:
+    """
+    Parse a directory of single-component metainfo files.
+
+    Legacy <application> roots are read as desktop applications.
+
+    Yields:
+        FlathubComponent for every desktop application in the directory.
+    """
+    for path in sorted(metainfo_dir.glob("*.xml")):
+        xml = path.read_bytes()
+        try:
+            elem = ET.fromstring(xml)
+        except ET.ParseError as e:
+            print(f"Warning: Skipping unparsable metainfo {path.name}: {e}")
+            continue
+        if elem.tag == "application":
+            elem.tag = "component"
+            elem.set("type", "desktop-application")
+            xml = None
+        if elem.tag != "component":
+            continue
+        component = _component_from_element(elem, icons_base_url, xml)
+        if component is not None:
+            yield component
+
+
+DESKTOP_TYPES = ("desktop", "desktop-application")
+COMPONENT_END_TAG_RE = re.compile(rb"</component\s*>")
+
+
+def iter_component_xml(
+    f: BinaryIO, chunk_size: int = 1 << 20, types: Container[str] | None = None
+) -> Iterator[bytes]:
+    """
+    Split an AppStream catalog into the source bytes of its <component> elements.
+
+    The stream is fed to expat in chunks, and the byte offsets it reports
+    for the start and end tags of each outermost component delimit the
+    component's source. Comments, CDATA sections and processing
+    instructions are therefore never mistaken for tags. Only the current
+    chunk plus one unfinished component are buffered. With types, other
+    components are skipped without being copied out.
 
-    # Check if we have a recent cache (less than 24 hours old)
-    if xml_path.exists():
-        age_hours = (time.time() - xml_path.stat().st_mtime) / 3600
-        if age_hours < 24:
-            print(f"Using cached Flathub data ({age_hours:.1f} hours old)")
-            return xml_path
+    Raises:
+        ET.ParseError: The catalog is not well-formed XML.
 
-    print("Downloading Flathub AppStream data...")
-    urllib.request.urlretrieve(FLATHUB_APPSTREAM_URL, gz_path)
+    Yields:
+        The bytes from "<component" through "</component>" of each component.
+    """
+    parser = expat.ParserCreate()
+    buffer = bytearray()
+    offset = 0  # byte index of buffer[0] in the stream
+    depth = 0  # open <component> elements
+    start = -1  # byte index of the current component's start tag
+    mark = 0  # byte index of the last tag expat reported; later bytes may be unparsed
+    spans: list[tuple[int, int]] = []
+
+    def start_element(name: str, attrs: dict[str, str]) -> None:
+        nonlocal depth, start, mark
+        mark = parser.CurrentByteIndex
+        if name != "component":
+            return
+        if depth == 0 and (types is None or attrs.get("type", "") in types):
+            start = parser.CurrentByteIndex
+        depth += 1
+
+    def end_element(name: str) -> None:
+        nonlocal depth, start, mark
+        mark = parser.CurrentByteIndex
+        if name != "component":
+            return
+        depth -= 1
+        if depth or start == -1:
+            return
+        # The index is that of the end tag, or just past an empty element
+        index = parser.CurrentByteIndex - offset
+        end_tag = COMPONENT_END_TAG_RE.match(buffer, index)
+        spans.append((start, (end_tag.end() if end_tag else index) + offset))
+        start = -1
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+
+    while True:
+        chunk = f.read(chunk_size)
+        buffer += chunk
+        try:
+            parser.Parse(chunk, not chunk)
+        except expat.ExpatError as e:
+            raise ET.ParseError(str(e)) from None
+
+        for span_start, span_end in spans:
+            yield bytes(buffer[span_start - offset : span_end - offset])
+        spans.clear()
+        if not chunk:
+            return
+
+        # Keep only an unfinished component, or what expat may still be holding
+        keep = (start if start != -1 else mark) - offset
+        del buffer[:keep]
+        offset += keep
+
+
+def iter_flathub_appstream(
+    xml_path: Path, icons_base_url: str | None = FLATHUB_ICONS_BASE_URL.format(arch=DEFAULT_ARCH)
+) -> Iterator[FlathubComponent]:
+    """
+    Incrementally parse the Flathub AppStream XML (plain or gzipped).
+
+    Cached icons resolve against icons_base_url. A directory is read as
+    individual metainfo files instead.
 
-    print("Decompressing...")
-    with gzip.open(gz_path, "rb") as f_in:
-        with open(xml_path, "wb") as f_out:
-            f_out.write(f_in.read())
+    The catalog is split into per-component byte ranges (see
+    iter_component_xml); only desktop applications are parsed, each element
+    is dropped once its fields are extracted, and the source bytes are kept
+    as the compact form for transformation and hashing. Memory use is
+    bounded by the retained bytes, not by element trees.
 
-    return xml_path
+    Yields:
+        FlathubComponent for every desktop application in the catalog.
+    """
+    if xml_path.is_dir():
+        yield from iter_metainfo_dir(xml_path, icons_base_url)
+        return
+
+    with open_appstream(xml_path) as f:
+        # Runtimes, add-ons and the like are skipped without parsing them
+        for xml in iter_component_xml(f, types=DESKTOP_TYPES):
+            try:
+                elem = ET.fromstring(xml)
+            except ET.ParseError as e:
+                print(f"Warning: Skipping unparsable component: {e}")
+                continue
+            component = _component_from_element(elem, icons_base_url, xml)
+            if component is not None:
+                yield component
 
 
-def parse_flathub_appstream(xml_path: Path) -> dict[str, FlathubComponent]:
+def parse_flathub_appstream(
+    xml_path: Path, icons_base_url: str | None = FLATHUB_ICONS_BASE_URL.format(arch=DEFAULT_ARCH)
+) -> dict[str, FlathubComponent]:
     """
     Parse the Flathub AppStream XML into components.
 
@@ -102,156 +581,873 @@ def parse_flathub_appstream(xml_path: Path) -> dict[str, FlathubComponent]:
         Dict mapping component ID to FlathubComponent.
     """
     print(f"Parsing {xml_path}...")
-    components = {}
+    components = {component.id: component for component in iter_flathub_appstream(xml_path, icons_base_url)}
 
-    # Parse the XML
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
+    print(f"Parsed {len(components)} desktop applications from {xml_path.name}")
+    return components
 
-    for component in root.findall(".//component"):
-        comp_type = component.get("type", "")
-        if comp_type not in ("desktop", "desktop-application"):
-            continue
 
-        comp_id = component.findtext("id", "").strip()
-        if not comp_id:
-            continue
+def file_sha256(path: Path) -> str:
+    """Hash a file in chunks without loading it into memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_fingerprint(path: Path) -> str:
+    """Content hash of a catalog file, or a stat-based hash of a metainfo directory."""
+    if not path.is_dir():
+        return file_sha256(path)
+    digest = hashlib.sha256()
+    for entry in sorted(path.glob("*.xml")):
+        st = entry.stat()
+        digest.update(f"{entry.name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def load_flathub_components(
+    xml_path: Path,
+    cache_dir: Path,
+    arch: str = DEFAULT_ARCH,
+    source: AppStreamSource = FLATHUB_SOURCE,
+) -> dict[str, FlathubComponent]:
+    """
+    Load parsed components of one source, reusing an on-disk cache when possible.
+
+    The cache is a pickle of flat per-component records (the scalar and
+    list fields plus the source XML bytes, no element trees) keyed by the
+    SHA-256 of the source catalog, so it is rebuilt automatically whenever
+    the catalog changes, and loading it is much cheaper than parsing.
+
+    Returns:
+        Dict mapping component ID to FlathubComponent.
+    """
+    cache_path = cache_dir / f"{source.name}-components{source.arch_suffix(arch)}.pickle"
+    source_hash = source_fingerprint(xml_path)
+    icons_base_url = source.icons_url(arch)
+    record_fields = [f.name for f in fields(FlathubComponent)]
+
+    if cache_path.exists():
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if (
+                cached.get("format") == COMPONENT_CACHE_FORMAT
+                and cached.get("source_hash") == source_hash
+                and cached.get("icons_base_url") == icons_base_url
+                and cached.get("fields") == record_fields
+            ):
+                components = {record[0]: FlathubComponent(*record) for record in cached["records"]}
+                print(f"Loaded {len(components)} parsed components from cache")
+                return components
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable component cache: {e}")
 
-        # Remove .desktop suffix if present for the ID
-        base_id = comp_id.removesuffix(".desktop")
-
-        name = component.findtext("name", "")
-        summary = component.findtext("summary", "")
-
-        # Get description (may have <p> tags)
-        desc_elem = component.find("description")
-        description = ""
-        if desc_elem is not None:
-            # Concatenate all text content
-            description = "".join(desc_elem.itertext()).strip()
-
-        # Categories
-        categories = []
-        for cat in component.findall(".//category"):
-            if cat.text:
-                categories.append(cat.text)
-
-        # Keywords
-        keywords = []
-        for kw in component.findall(".//keyword"):
-            if kw.text:
-                keywords.append(kw.text)
-
-        # Screenshots
-        screenshots = []
-        for screenshot in component.findall(".//screenshot/image"):
-            if screenshot.text and screenshot.get("type") == "source":
-                screenshots.append(screenshot.text)
-
-        # Icon
-        icon_url = None
-        for icon in component.findall("icon"):
-            if icon.get("type") == "remote" and icon.text:
-                icon_url = icon.text
-                break
-            elif icon.get("type") == "cached" and icon.text:
-                # Build URL from cached icon
-                icon_url = f"{FLATHUB_ICONS_BASE_URL}/128x128/{icon.text}"
-                break
-
-        # Other metadata
-        homepage = None
-        for url in component.findall("url"):
-            if url.get("type") == "homepage":
-                homepage = url.text
-                break
-
-        license_id = component.findtext("project_license", "")
-        developer_name = component.findtext("developer_name", "")
-
-        # Store raw XML for later transformation
-        raw_xml = ET.tostring(component, encoding="unicode")
-
-        components[base_id] = FlathubComponent(
-            id=base_id,
-            name=name,
-            summary=summary,
-            description=description,
-            categories=categories,
-            keywords=keywords,
-            screenshots=screenshots,
-            icon_url=icon_url,
-            homepage=homepage,
-            license=license_id,
-            developer_name=developer_name,
-            raw_xml=raw_xml,
+    components = parse_flathub_appstream(xml_path, icons_base_url)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(cache_path.name + ".part")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(
+            {
+                "format": COMPONENT_CACHE_FORMAT,
+                "source_hash": source_hash,
+                "icons_base_url": icons_base_url,
+                "fields": record_fields,
+                "records": [
+                    tuple(getattr(component, name) for name in record_fields) for component in components.values()
+                ],
+            },
+            f,
+            protocol=pickle.HIGHEST_PROTOCOL,
         )
+    tmp_path.replace(cache_path)
 
-    print(f"Parsed {len(components)} desktop applications from Flathub")
     return components
 
 
-def scan_nixpkgs_desktop_files(nixpkgs_path: Path | None = None) -> dict[str, NixPackage]:
+class ComponentStore:
     """
-    Scan nixpkgs for packages that provide .desktop files.
+    Hash-indexed store of components merged from several AppStream sources.
 
-    This uses nix-env or nix search to find packages, then examines their
-    desktop files to extract AppStream IDs.
+    Components are interned by xml_hash, so one that appears unchanged in
+    several sources or architectures is held (and transformed) once. Each
+    architecture's view maps a component ID to the copy from the
+    highest-priority source that provides it.
+    """
+
+    def __init__(self) -> None:
+        self.by_hash: dict[str, FlathubComponent] = {}
+        self.views: dict[str, dict[str, FlathubComponent]] = {}
+        self.origins: dict[str, dict[str, str]] = {}  # arch -> component ID -> source name
+        self._priorities: dict[str, dict[str, int]] = {}
+        self.shared = 0
+
+    def intern(self, component: FlathubComponent) -> FlathubComponent:
+        """Return the stored component with the same XML, adding this one if new."""
+        existing = self.by_hash.setdefault(component.xml_hash, component)
+        if existing is not component:
+            self.shared += 1
+        return existing
+
+    def add(self, arch: str, source: AppStreamSource, components: dict[str, FlathubComponent]) -> int:
+        """
+        Merge one source's components into an architecture's view.
+
+        On equal priority the source added first keeps the ID.
+
+        Returns:
+            Number of component IDs this source now provides.
+        """
+        view = self.views.setdefault(arch, {})
+        origins = self.origins.setdefault(arch, {})
+        priorities = self._priorities.setdefault(arch, {})
+        provided = 0
+
+        for comp_id, component in components.items():
+            component = self.intern(component)
+            current = priorities.get(comp_id)
+            if current is not None and current >= source.priority:
+                continue
+            view[comp_id] = component
+            origins[comp_id] = source.name
+            priorities[comp_id] = source.priority
+            provided += 1
+
+        return provided
+
+    def merged(self) -> dict[str, FlathubComponent]:
+        """Union of all architecture views; the first architecture wins on conflicts."""
+        merged: dict[str, FlathubComponent] = {}
+        for view in self.views.values():
+            for comp_id, component in view.items():
+                merged.setdefault(comp_id, component)
+        return merged
+
+
+def load_component_store(
+    sources: list[AppStreamSource],
+    paths: dict[tuple[str, str], Path],
+    arches: list[str],
+    cache_dir: Path,
+) -> ComponentStore:
+    """
+    Parse every fetched source and merge the results by component ID.
+
+    A source whose location does not depend on the architecture is parsed
+    once and shared by all architecture views.
 
     Returns:
-        Dict mapping desktop file ID (without .desktop) to NixPackage.
+        The populated ComponentStore.
     """
-    print("Scanning nixpkgs for desktop files...")
+    store = ComponentStore()
+    parsed: dict[Path, dict[str, FlathubComponent]] = {}
+
+    for arch in arches:
+        for source in sorted(sources, key=lambda s: -s.priority):
+            path = paths[(source.name, arch)]
+            if path not in parsed:
+                parsed[path] = load_flathub_components(path, cache_dir, arch, source)
+            provided = store.add(arch, source, parsed[path])
+            if len(sources) > 1:
+                print(f"{source.name} ({arch}): {provided} of {len(parsed[path])} components used")
+
+    if store.shared:
+        print(f"Shared {store.shared} identical components across sources and architectures")
+    return store
+
+
+def nixpkgs_flake_ref(nixpkgs_path: Path | None = None) -> str:
+    """
+    Flake reference for a local nixpkgs checkout, or the registry nixpkgs.
+
+    A git checkout goes through nix's git fetcher, which locks it to its
+    commit and copies only tracked files; a path: reference would copy and
+    hash the whole directory, .git included, on every run.
+    """
+    if nixpkgs_path is not None:
+        path = nixpkgs_path.resolve()
+        if (path / ".git").exists():
+            return f"git+file://{path}"
+        return f"path:{path}"
+    return "nixpkgs"
+
+
+def nix_system(arch: str) -> str:
+    """Nix system double for a Flathub architecture (x86_64 -> x86_64-linux)."""
+    return f"{arch}-linux"
+
+
+def resolve_nixpkgs_revision(flake_ref: str) -> tuple[str, str] | None:
+    """
+    Lock a nixpkgs flake reference.
+
+    The revision identifies the content: the locked git revision when there
+    is one (registry or git inputs), otherwise the NAR hash of the source
+    tree (local paths). The locked reference pins that same content, so a
+    later evaluation cannot drift to a newer revision of an unlocked ref.
+
+    Returns:
+        (revision, locked flake reference), or None if it cannot be resolved.
+    """
+    cmd = [
+        "nix",
+        "flake",
+        "metadata",
+        "--json",
+        flake_ref,
+        "--extra-experimental-features",
+        "nix-command flakes",
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            return None
+        metadata = json.loads(result.stdout)
+    except (OSError, subprocess.TimeoutExpired, json.JSONDecodeError):
+        return None
+
+    locked = metadata.get("locked", {})
+    revision = locked.get("rev") or locked.get("narHash") or metadata.get("revision")
+    if not revision:
+        return None
+
+    # Older nix reports the locked URL as lockedUrl, newer ones as url
+    locked_ref = metadata.get("lockedUrl")
+    if not locked_ref and revision in metadata.get("url", ""):
+        locked_ref = metadata["url"]
+    if not locked_ref and locked.get("type") in ("github", "gitlab", "sourcehut") and locked.get("rev"):
+        locked_ref = f"{locked['type']}:{locked['owner']}/{locked['repo']}/{locked['rev']}"
+    if not locked_ref and locked.get("type") == "git" and locked.get("rev"):
+        locked_ref = f"git+{locked['url']}?rev={locked['rev']}"
+    if not locked_ref and locked.get("type") == "path" and locked.get("narHash"):
+        locked_ref = f"path:{locked['path']}?narHash={urllib.parse.quote(locked['narHash'], safe='')}"
+    if not locked_ref:
+        return None
+    return revision, locked_ref
+
+
+class JSONStreamReader:
+    """
+    Minimal incremental reader for large JSON objects.
+
+    Walks an object's members one at a time, decoding each value with
+    json.JSONDecoder.raw_decode as soon as enough text has arrived, so only
+    the current member is ever buffered or decoded.
+    """
+
+    def __init__(self, stream: IO[str], chunk_size: int = 1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Read another chunk, dropping consumed text. Returns False at EOF."""
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos : self.pos + 1]
+
+    def _expect(self, char: str) -> None:
+        found = self._peek()
+        if found != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}, found {found!r}", self.buf, self.pos)
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the very end of the buffer may still be incomplete
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def object_items(self, path: tuple[str, ...] = ()) -> Iterator[tuple[str, Any]]:
+        """
+        Yield (key, value) members of the object at the current position.
+
+        With a path, descend into the member with each successive key first
+        (e.g. ("packages",)) and yield that nested object's members instead;
+        sibling members on the way are decoded and discarded.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(":")
+            if not path:
+                yield key, self.value()
+            elif key == path[0]:
+                yield from self.object_items(path[1:])
+            else:
+                self.value()
+
+            separator = self._peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise json.JSONDecodeError(f"Expecting ',' or '}}', found {separator!r}", self.buf, self.pos - 1)
+
+
+def read_nix_search_json(stream: IO[str]) -> dict[str, NixPackage]:
+    """
+    Build NixPackage entries from `nix search --json` output as it is read.
 
-    # Use nix search to get all packages with meta.mainProgram or that look like GUI apps
-    # This is a heuristic approach - we'll refine based on what works
+    Returns:
+        Dict mapping nixpkgs attr to NixPackage.
+    """
     packages = {}
 
-    # Strategy: Query nix for packages and check their outputs for .desktop files
-    # For now, let's use a faster approach: search for common GUI app patterns
+    for attr_path, pkg_info in JSONStreamReader(stream).object_items():
+        # attr_path is like "legacyPackages.x86_64-linux.firefox"; keep the
+        # full path below the system so nested sets do not collide
+        parts = attr_path.split(".")
+        if len(parts) >= 3:
+            attr = ".".join(parts[2:])
+            version = pkg_info.get("version", "unknown")
+
+            packages[attr] = NixPackage(
+                attr=attr,
+                version=version,
+                desktop_ids=[],
+                pname=pkg_info.get("pname"),
+            )
+
+    return packages
+
+
+def nix_search_packages(
+    flake_ref: str = "nixpkgs", timeout: float = 300, system: str | None = None
+) -> dict[str, NixPackage]:
+    """
+    Run nix search over every package in a nixpkgs flake.
+
+    nix search covers the host system's packages; with system, it covers
+    legacyPackages.<system> instead.
 
+    The JSON output is consumed incrementally as nix writes it, building
+    each NixPackage as its record arrives rather than holding the whole
+    output text and decoded document in memory.
+
+    Returns:
+        Dict mapping nixpkgs attr to NixPackage (empty on failure).
+    """
+    packages = {}
+
+    installable = f"{flake_ref}#legacyPackages.{system}" if system else flake_ref
     cmd = [
         "nix",
         "search",
-        "nixpkgs",
+        installable,
         "--json",
         ".",  # Search all
         "--extra-experimental-features",
         "nix-command flakes",
     ]
 
-    try:
-        print("Running nix search (this may take a while)...")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-        if result.returncode != 0:
-            print(f"Warning: nix search failed: {result.stderr}")
+    print("Running nix search (this may take a while)...")
+    with tempfile.TemporaryFile(mode="w+") as stderr:
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        except OSError as e:
+            print(f"Warning: nix search failed: {e}")
             return packages
 
-        search_results = json.loads(result.stdout)
+        timer = threading.Timer(timeout, proc.kill)
+        timer.start()
+        parse_error = None
+        try:
+            packages = read_nix_search_json(proc.stdout)
+        except json.JSONDecodeError as e:
+            parse_error = e
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+            timed_out = not timer.is_alive()
+            timer.cancel()
+
+        if timed_out:
+            print("Warning: nix search timed out")
+            return {}
+        if returncode != 0:
+            stderr.seek(0)
+            print(f"Warning: nix search failed: {stderr.read()}")
+            return {}
+        if parse_error is not None:
+            print(f"Warning: Failed to parse nix search output: {parse_error}")
+            return {}
 
-        for attr_path, pkg_info in search_results.items():
-            # attr_path is like "legacyPackages.x86_64-linux.firefox"
-            parts = attr_path.split(".")
-            if len(parts) >= 3:
-                attr = parts[-1]
-                version = pkg_info.get("version", "unknown")
+    return packages
 
-                packages[attr] = NixPackage(
-                    attr=attr,
-                    version=version,
-                    desktop_ids=[],
-                )
 
+class BrotliReader(io.RawIOBase):
+    """
+    Raw binary stream that decompresses a brotli file on the fly.
+
+    Uses the brotli Python module if it is installed, and otherwise streams
+    the output of the brotli command line tool.
+    """
+
+    def __init__(self, path: Path, chunk_size: int = 1 << 16):
+        self._path = path
+        self._proc = None
+        self._decompressor = None
+        if brotli is not None:
+            self._file = open(path, "rb")
+            self._decompressor = brotli.Decompressor()
+        else:
+            try:
+                self._proc = subprocess.Popen(["brotli", "-dc", "--", str(path)], stdout=subprocess.PIPE)
+            except OSError:
+                raise RuntimeError(
+                    f"Reading {path} requires the 'brotli' Python module or the brotli command"
+                ) from None
+            self._file = self._proc.stdout
+        self._chunk_size = chunk_size
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = self._file.read(self._chunk_size)
+            if not chunk:
+                if self._proc and self._proc.wait():
+                    raise RuntimeError(f"brotli failed to decompress {self._path}")
+                return 0
+            self._pending = self._decompressor.process(chunk) if self._decompressor else chunk
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self) -> None:
+        self._file.close()
+        if self._proc:
+            # Closed before the end of the output
+            if self._proc.poll() is None:
+                self._proc.kill()
+            self._proc.wait()
+        super().close()
+
+
+def open_packages_json(path: Path) -> IO[str]:
+    """Open a nixpkgs packages.json, packages.json.br or packages.json.gz as text."""
+    if path.suffix == ".br":
+        return io.TextIOWrapper(io.BufferedReader(BrotliReader(path)), encoding="utf-8")
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def meta_homepage(meta: dict) -> str | None:
+    """meta.homepage, which may be a string or a list of strings."""
+    homepage = meta.get("homepage")
+    if isinstance(homepage, list):
+        homepage = homepage[0] if homepage else None
+    return homepage if isinstance(homepage, str) else None
+
+
+def meta_license(meta: dict) -> str | None:
+    """meta.license as an SPDX-style expression, e.g. "MIT AND Apache-2.0"."""
+    licenses = meta.get("license")
+    if licenses is None:
+        return None
+    if not isinstance(licenses, list):
+        licenses = [licenses]
+
+    ids = []
+    for lic in licenses:
+        if isinstance(lic, str):
+            ids.append(lic)
+        elif isinstance(lic, dict):
+            lic_id = lic.get("spdxId") or lic.get("shortName") or lic.get("fullName")
+            if lic_id:
+                ids.append(lic_id)
+    return " AND ".join(ids) or None
+
+
+def load_packages_json(path: Path, system: str = "x86_64-linux") -> dict[str, NixPackage]:
+    """
+    Load nixpkgs packages from a packages.json dump instead of evaluating nixpkgs.
+
+    This is the file pkglistgen consumes (e.g. the channel's
+    packages.json.br). It is read as a stream, one package record at a
+    time, and provides richer metadata than nix search: homepage, license
+    and mainProgram.
+
+    Returns:
+        Dict mapping nixpkgs attr to NixPackage.
+    """
+    print(f"Reading nixpkgs packages from {path}...")
+    packages = {}
+
+    with open_packages_json(path) as f:
+        for attr, pkg_info in JSONStreamReader(f).object_items(("packages",)):
+            if pkg_info.get("system", system) != system:
+                continue
+            meta = pkg_info.get("meta") or {}
+
+            packages[attr] = NixPackage(
+                attr=attr,
+                version=pkg_info.get("version") or "unknown",
+                desktop_ids=[],
+                pname=pkg_info.get("pname"),
+                homepage=meta_homepage(meta),
+                license=meta_license(meta),
+                main_program=meta.get("mainProgram"),
+            )
+
+    print(f"Found {len(packages)} packages in {path.name}")
+    return packages
+
+
+def scan_nixpkgs_desktop_files(
+    nixpkgs_path: Path | None = None,
+    scan_store: bool = False,
+    cache_dir: Path | None = None,
+    jobs: int = 8,
+    system: str | None = None,
+) -> dict[str, NixPackage]:
+    """
+    Scan nixpkgs for packages that provide .desktop files.
+
+    This uses nix-env or nix search to find packages, then examines their
+    desktop files to extract AppStream IDs. With scan_store, the outputs of
+    packages already realized in /nix/store are walked (see
+    scan_store_desktop_files) to fill in NixPackage.desktop_ids.
+
+    The search covers nixpkgs_path if given, otherwise the registry nixpkgs.
+    Its result only depends on the nixpkgs revision, so with cache_dir the
+    reference is locked first, the search runs against the locked
+    reference, and the result is stored keyed by that revision; a rerun
+    against the same revision skips evaluation entirely. With system, the
+    packages of that system are searched instead of the host's.
+
+    Returns:
+        Dict mapping nixpkgs attr to NixPackage.
+    """
+    print("Scanning nixpkgs for desktop files...")
+
+    flake_ref = nixpkgs_flake_ref(nixpkgs_path)
+    lock = resolve_nixpkgs_revision(flake_ref) if cache_dir else None
+    cache_path = None
+    packages = None
+    search_ref = flake_ref
+
+    if lock:
+        revision, search_ref = lock
+        key = hashlib.sha256(f"{NIX_SEARCH_CACHE_FORMAT}\0{flake_ref}\0{revision}\0{system}".encode()).hexdigest()[:16]
+        cache_path = cache_dir / f"nix-search-{key}.pickle"
+        if cache_path.exists():
+            try:
+                with open(cache_path, "rb") as f:
+                    packages = pickle.load(f)
+                print(f"Loaded {len(packages)} packages from nix search cache ({revision})")
+            except Exception as e:
+                print(f"Warning: Ignoring unreadable nix search cache: {e}")
+
+    if packages is None:
+        packages = nix_search_packages(search_ref, system=system)
         print(f"Found {len(packages)} packages in nixpkgs")
 
-    except subprocess.TimeoutExpired:
-        print("Warning: nix search timed out")
-    except json.JSONDecodeError as e:
-        print(f"Warning: Failed to parse nix search output: {e}")
+        if cache_path and packages:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(cache_path.name + ".part")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(packages, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(cache_path)
+
+    if scan_store:
+        scan_store_desktop_files(packages, cache_dir, jobs=jobs)
 
     return packages
 
 
+def desktop_ids_in_store_path(store_path: Path) -> list[str]:
+    """
+    Collect the desktop IDs a realized store path provides.
+
+    Looks at share/applications/*.desktop and at the component IDs and
+    desktop-id launchables of share/metainfo (or legacy share/appdata) XML.
+
+    Returns:
+        Desktop IDs with a .desktop suffix, e.g. ["org.mozilla.firefox.desktop"].
+    """
+    share = store_path / "share"
+    ids = []
+
+    applications = share / "applications"
+    if applications.is_dir():
+        ids.extend(sorted(p.name for p in applications.glob("*.desktop")))
+
+    for subdir in ("metainfo", "appdata"):
+        metainfo_dir = share / subdir
+        if not metainfo_dir.is_dir():
+            continue
+        for metainfo in sorted(metainfo_dir.glob("*.xml")):
+            try:
+                root = ET.parse(metainfo).getroot()
+            except (ET.ParseError, OSError):
+                continue
+            found = [root.findtext("id", "").strip()]
+            found.extend(
+                (launchable.text or "").strip()
+                for launchable in root.iter("launchable")
+                if launchable.get("type") == "desktop-id"
+            )
+            ids.extend(f"{i.removesuffix('.desktop')}.desktop" for i in found if i)
+
+    return list(dict.fromkeys(ids))
+
+
+def scan_store_desktop_files(
+    packages: dict[str, NixPackage],
+    cache_dir: Path | None = None,
+    jobs: int = 8,
+    store_dir: Path = Path("/nix/store"),
+) -> int:
+    """
+    Fill in desktop_ids for packages whose output is realized in the store.
+
+    Store entries are matched to packages by their "<pname>-<version>"
+    name, so no evaluation or building is needed; only paths that already
+    exist are scanned, across a pool of jobs threads. Store paths are
+    immutable, so results are cached by path in cache_dir and reused on
+    later runs.
+
+    Returns:
+        Number of packages that gained desktop IDs.
+    """
+    by_name: dict[str, list[NixPackage]] = defaultdict(list)
+    for pkg in packages.values():
+        if pkg.pname and pkg.version:
+            by_name[f"{pkg.pname}-{pkg.version}"].append(pkg)
+
+    try:
+        entries = [
+            entry.name
+            for entry in os.scandir(store_dir)
+            if len(entry.name) > 33 and entry.name[33:] in by_name and entry.is_dir()
+        ]
+    except OSError as e:
+        print(f"Warning: Cannot list {store_dir}: {e}")
+        return 0
+
+    cache_path = cache_dir / "store-desktop-ids.json" if cache_dir else None
+    cached: dict[str, list[str]] = {}
+    if cache_path and cache_path.exists():
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Ignoring unreadable store scan cache: {e}")
+
+    to_scan = [name for name in entries if name not in cached]
+    print(f"Scanning {len(to_scan)} store paths for desktop files ({len(entries) - len(to_scan)} cached)...")
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for name, ids in zip(to_scan, executor.map(desktop_ids_in_store_path, (store_dir / n for n in to_scan))):
+            cached[name] = ids
+
+    updated = 0
+    for name in entries:
+        ids = cached[name]
+        if not ids:
+            continue
+        for pkg in by_name[name[33:]]:
+            pkg.store_path = str(store_dir / name)
+            pkg.desktop_ids = list(dict.fromkeys([*pkg.desktop_ids, *ids]))
+            updated += 1
+
+    if cache_path:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # Only keep paths that are still present, so the cache tracks the store
+        with open(cache_path, "w") as f:
+            json.dump({name: cached[name] for name in sorted(entries)}, f)
+
+    print(f"Found desktop files for {updated} packages in the store")
+    return updated
+
+
+# Desktop-ID evidence in nixpkgs expressions
+MAKE_DESKTOP_ITEM_RE = re.compile(r"makeDesktopItem\s*(?:\(\s*)?\{")
+DESKTOP_ITEM_NAME_RE = re.compile(r"(?<![\w-])name\s*=\s*\"(?P<name>[^\"]+)\"")
+PNAME_RE = re.compile(r"(?<![\w-])pname\s*=\s*\"(?P<pname>[^\"$]+)\"")
+DESKTOP_FILE_RE = re.compile(r"(?P<id>[A-Za-z0-9][\w.+-]*)\.desktop\b")
+METAINFO_FILE_RE = re.compile(r"(?P<id>[A-Za-z0-9][\w.+-]*?)\.(?:appdata|metainfo)\.xml\b")
+
+# Bump when the source index entry format or extraction rules change
+SOURCE_INDEX_FORMAT = 1
+
+
+def desktop_ids_in_nix_file(path: Path) -> list[str]:
+    """
+    Extract desktop-ID evidence from one file of a nixpkgs checkout.
+
+    Finds makeDesktopItem names, referenced .desktop filenames and
+    appdata/metainfo XML references in .nix files; .desktop and metainfo
+    files shipped in the tree count by their own filename.
+
+    Returns:
+        Desktop IDs with a .desktop suffix.
+    """
+    name = path.name
+    if name.endswith(".desktop"):
+        return [name]
+    match = METAINFO_FILE_RE.fullmatch(name)
+    if match:
+        return [f"{match['id']}.desktop"]
+
+    try:
+        text = path.read_text(errors="replace")
+    except OSError:
+        return []
+
+    pname_match = PNAME_RE.search(text)
+    pname = pname_match["pname"] if pname_match else None
+
+    ids = []
+    for item in MAKE_DESKTOP_ITEM_RE.finditer(text):
+        # The name attribute sits near the top of the item's attrset
+        name_match = DESKTOP_ITEM_NAME_RE.search(text, item.end(), item.end() + 600)
+        if not name_match:
+            continue
+        item_name = name_match["name"]
+        if pname:
+            item_name = item_name.replace("${pname}", pname)
+        if "${" not in item_name:
+            ids.append(f"{item_name.removesuffix('.desktop')}.desktop")
+
+    for match in DESKTOP_FILE_RE.finditer(text):
+        if "${" not in match["id"]:
+            ids.append(f"{match['id']}.desktop")
+    for match in METAINFO_FILE_RE.finditer(text):
+        ids.append(f"{match['id']}.desktop")
+
+    return list(dict.fromkeys(ids))
+
+
+def scan_nixpkgs_source(nixpkgs_path: Path, cache_dir: Path | None = None, jobs: int = 8) -> dict[str, list[str]]:
+    """
+    Index desktop-ID evidence in a local nixpkgs checkout, per package directory.
+
+    Every file under pkgs/ is stat'ed, but only files whose mtime or size
+    changed since the last run are read again (on a pool of jobs threads);
+    the per-file results are kept in a persistent index in cache_dir, so a
+    rescan after a git pull only touches what the pull changed.
+
+    Returns:
+        Dict mapping package directory name (e.g. "firefox" for
+        pkgs/by-name/fi/firefox) to desktop IDs found in it.
+    """
+    pkgs_dir = nixpkgs_path / "pkgs"
+    print(f"Scanning nixpkgs source tree at {nixpkgs_path}...")
+
+    cache_path = None
+    index: dict[str, dict] = {}
+    if cache_dir:
+        key = hashlib.sha256(str(nixpkgs_path.resolve()).encode()).hexdigest()[:16]
+        cache_path = cache_dir / f"nixpkgs-source-{key}.json"
+        if cache_path.exists():
+            try:
+                with open(cache_path) as f:
+                    cached = json.load(f)
+                if cached.get("format") == SOURCE_INDEX_FORMAT:
+                    index = cached["files"]
+            except (OSError, json.JSONDecodeError, KeyError) as e:
+                print(f"Warning: Ignoring unreadable nixpkgs source index: {e}")
+
+    current: dict[str, dict] = {}
+    changed: list[str] = []
+    for dirpath, _dirnames, filenames in os.walk(pkgs_dir):
+        for filename in filenames:
+            if not filename.endswith((".nix", ".desktop", ".xml")):
+                continue
+            full = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            rel = os.path.relpath(full, nixpkgs_path)
+            entry = index.get(rel)
+            if entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                current[rel] = entry
+            else:
+                current[rel] = {"mtime": st.st_mtime_ns, "size": st.st_size, "ids": []}
+                changed.append(rel)
+
+    print(f"Reading {len(changed)} changed files ({len(current) - len(changed)} unchanged)...")
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for rel, ids in zip(changed, executor.map(desktop_ids_in_nix_file, (nixpkgs_path / r for r in changed))):
+            current[rel]["ids"] = ids
+
+    if cache_path:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(cache_path.name + ".part")
+        with open(tmp_path, "w") as f:
+            json.dump({"format": SOURCE_INDEX_FORMAT, "files": current}, f)
+        tmp_path.replace(cache_path)
+
+    evidence: dict[str, list[str]] = defaultdict(list)
+    for rel, entry in current.items():
+        if entry["ids"]:
+            package_dir = Path(rel).parent.name
+            evidence[package_dir].extend(entry["ids"])
+
+    result = {name: list(dict.fromkeys(ids)) for name, ids in evidence.items()}
+    print(f"Found desktop-ID evidence for {len(result)} package directories")
+    return result
+
+
+def apply_source_desktop_ids(packages: dict[str, NixPackage], evidence: dict[str, list[str]]) -> int:
+    """
+    Attach source-tree desktop-ID evidence to packages.
+
+    A package directory is matched to packages whose attr leaf or pname
+    equals its name, which holds for pkgs/by-name and most other packages.
+
+    Returns:
+        Number of packages that gained desktop IDs.
+    """
+    updated = 0
+    for pkg in packages.values():
+        names = {pkg.attr.rsplit(".", 1)[-1], pkg.pname}
+        ids = [i for name in names if name in evidence for i in evidence[name]]
+        if ids:
+            pkg.desktop_ids = list(dict.fromkeys([*pkg.desktop_ids, *ids]))
+            updated += 1
+    return updated
+
+
 def build_desktop_id_mapping() -> dict[str, str]:
     """
     Build a mapping of common desktop IDs to nixpkgs attributes.
@@ -398,127 +1594,1080 @@ def build_desktop_id_mapping() -> dict[str, str]:
     }
 
 
-def create_mapping(
-    flathub_components: dict[str, FlathubComponent],
-    nixpkgs_packages: dict[str, NixPackage],
-    desktop_id_mapping: dict[str, str],
-) -> list[Mapping]:
+@dataclass
+class PackageOverride:
+    """Customisation of one nixpkgs attr, as read from custom.json."""
+
+    attr: str  # e.g., "discord"
+    metainfo_url: str | None = None  # metainfo to use for the package
+    icon_url: str | None = None  # icon to use instead of the component's own
+    component_id: str | None = None  # component ID to publish
+    output_icon: str | None = None  # icon file name, e.g., "org.yuzu_emu.yuzu_ea.png"
+    output_metainfo: str | None = None  # generator metainfo file name; no catalog equivalent
+    metainfo_path: Path | None = None  # cached copy, set by OverrideIndex.fetch
+    icon_path: Path | None = None  # cached copy, set by OverrideIndex.fetch
+
+    def icon_stem(self, component_id: str) -> str:
+        """Catalog icon file name without extension."""
+        return Path(self.output_icon).stem if self.output_icon else component_id
+
+
+class OverrideIndex:
     """
-    Create mappings between Flathub components and nixpkgs packages.
+    custom.json overrides, keyed by nixpkgs attr.
 
-    Returns:
-        List of Mapping objects.
+    A reverse index from component ID to attr covers ID overrides and, once
+    parsed, the components of override metainfo, so create_mapping can pin
+    them with a single dict lookup.
     """
-    print("Creating mappings...")
-    mappings = []
 
-    for flathub_id, _component in flathub_components.items():
-        # Check if we have a direct mapping
-        if flathub_id in desktop_id_mapping:
-            nixpkgs_attr = desktop_id_mapping[flathub_id]
-            if nixpkgs_attr in nixpkgs_packages:
-                pkg = nixpkgs_packages[nixpkgs_attr]
-                mappings.append(
-                    Mapping(
-                        flathub_id=flathub_id,
-                        nixpkgs_attr=nixpkgs_attr,
-                        nixpkgs_version=pkg.version,
-                        confidence=1.0,
-                    )
+    def __init__(self, overrides: Iterable[PackageOverride]):
+        self.by_attr = {override.attr: override for override in overrides}
+        self.by_component = {
+            override.component_id.removesuffix(".desktop"): override.attr
+            for override in self.by_attr.values()
+            if override.component_id
+        }
+
+    @classmethod
+    def load(cls, path: Path) -> "OverrideIndex":
+        """Read a custom.json file in the format the Rust generator uses."""
+        with open(path) as f:
+            data = json.load(f)
+
+        overrides = []
+        for attr, entry in data.items():
+            output = entry.get("output") or {}
+            overrides.append(
+                PackageOverride(
+                    attr=attr,
+                    metainfo_url=entry.get("metainfo"),
+                    icon_url=entry.get("icon"),
+                    component_id=entry.get("id"),
+                    output_icon=output.get("icon"),
+                    output_metainfo=output.get("metainfo"),
                 )
+            )
+        print(f"Loaded {len(overrides)} package overrides from {path}")
+        return cls(overrides)
+
+    def get(self, attr: str) -> PackageOverride | None:
+        return self.by_attr.get(attr)
+
+    def attr_for(self, component_id: str) -> str | None:
+        """The attr custom.json pins a component to, if any."""
+        return self.by_component.get(component_id)
+
+    def fetch(self, cache_dir: Path, max_age_hours: float = 24.0, jobs: int = 8, icons: bool = True) -> None:
+        """
+        Download override metainfo and icons concurrently.
+
+        Everything goes through download_cached under cache_dir/overrides,
+        so overrides follow the same revalidation policy as the catalogs.
+        Failed downloads are reported and leave the override without a
+        local copy.
+        """
+        override_dir = cache_dir / "overrides"
+        metainfo_futures = []
+        icon_futures = []
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for override in self.by_attr.values():
+                if override.metainfo_url:
+                    dest = override_dir / f"{override.attr}.metainfo.xml"
+                    future = executor.submit(download_cached, override.metainfo_url, dest, max_age_hours)
+                    metainfo_futures.append((override, future))
+                if override.icon_url and icons and not is_vector_icon(override.icon_url):
+                    suffix = Path(urllib.parse.urlsplit(override.icon_url).path).suffix or ".png"
+                    dest = override_dir / f"{override.attr}.icon{suffix}"
+                    icon_futures.append((override, executor.submit(download_cached, override.icon_url, dest, max_age_hours)))
+
+        for override, future in metainfo_futures:
+            try:
+                override.metainfo_path = future.result()
+            except Exception as e:
+                print(f"Warning: Failed to fetch metainfo override for {override.attr}: {e}")
+        for override, future in icon_futures:
+            try:
+                override.icon_path = future.result()
+            except Exception as e:
+                print(f"Warning: Failed to fetch icon override for {override.attr}: {e}")
+
+    def components(self) -> dict[str, FlathubComponent]:
+        """
+        Parse the fetched override metainfo.
+
+        ID overrides are applied to the parsed <id>, and every component is
+        pinned to its attr.
+
+        Returns:
+            Dict mapping component ID to FlathubComponent.
+        """
+        components = {}
+        for override in self.by_attr.values():
+            if override.metainfo_path is None:
+                continue
+            try:
+                root = ET.parse(override.metainfo_path).getroot()
+            except ET.ParseError as e:
+                print(f"Warning: Skipping unparsable metainfo override for {override.attr}: {e}")
                 continue
+            if root.tag == "application":
+                root.tag = "component"
+                root.set("type", "desktop-application")
+            if override.component_id:
+                id_elem = root.find("id")
+                if id_elem is None:
+                    id_elem = ET.SubElement(root, "id")
+                id_elem.text = override.component_id
+
+            component = _component_from_element(root, None)
+            if component is None:
+                print(f"Warning: Metainfo override for {override.attr} is not a desktop application")
+                continue
+            components[component.id] = component
+            self.by_component[component.id] = override.attr
+        return components
+
+
+class AttrLeafIndex:
+    """
+    Index of nixpkgs attribute paths by their last segment.
+
+    Nested paths such as "jetbrains.idea-community" and "idea-community"
+    share a leaf; every path is kept instead of letting them overwrite each
+    other.
+    """
+
+    def __init__(self, attrs: Iterable[str] = ()):
+        self.leaves: dict[str, list[str]] = defaultdict(list)
+        for attr in attrs:
+            self.insert(attr)
+
+    def insert(self, attr: str) -> None:
+        self.leaves[attr.rsplit(".", 1)[-1].lower()].append(attr)
+
+    def leaf(self, name: str) -> list[str]:
+        """All attribute paths whose last segment is name (case-insensitive)."""
+        return self.leaves.get(name.lower(), [])
+
+
+# Reverse-DNS segments that carry no information about the application
+GENERIC_ID_SEGMENTS = frozenset(
+    {"org", "com", "net", "io", "de", "fr", "nl", "me", "dev", "app", "co", "uk", "eu", "info",
+     "github", "gitlab", "codeberg", "sourceforge", "sr", "ht", "page", "desktop"}
+)
+
+# Minimum trigram similarity for a fuzzy name match to be accepted
+FUZZY_MATCH_THRESHOLD = 0.75
+
+
+def normalize_key(text: str) -> str:
+    """Lowercase and drop separators, so "gnome-text-editor" == "GnomeTextEditor"."""
+    return re.sub(r"[^a-z0-9]", "", text.lower())
+
+
+def split_tokens(text: str) -> list[str]:
+    """Split an identifier into lowercase words on separators and camelCase."""
+    spaced = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    return [t for t in re.split(r"[^A-Za-z0-9]+", spaced.lower()) if t]
+
+
+def trigrams(key: str) -> set[str]:
+    """Character trigrams of a normalized key, with boundary markers."""
+    padded = f"^{key}$"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class Candidate:
+    """A ranked nixpkgs attribute for a Flathub component."""
+
+    attr: str
+    similarity: float  # 0.0 to 1.0
+
+
+class PackageIndex:
+    """
+    Candidate-generation index over the nixpkgs attribute set.
+
+    Built once per run. Attributes are indexed by their separator-insensitive
+    key and by character trigrams of that key; each trigram posting list is
+    capped, so a lookup touches a bounded number of attributes no matter how
+    large nixpkgs is. Known desktop IDs are indexed as well, and the full
+    attribute paths are indexed by leaf name.
+    """
+
+    # Trigrams shared by more attributes than this are too common to rank by
+    MAX_POSTING = 2000
+
+    def __init__(self, nixpkgs_packages: dict[str, NixPackage]):
+        self.by_key: dict[str, list[str]] = defaultdict(list)
+        self.by_trigram: dict[str, list[str]] = defaultdict(list)
+        self.by_desktop_id: dict[str, list[str]] = defaultdict(list)
+        self.trigram_counts: dict[str, int] = {}
+        self.attrs = AttrLeafIndex()
+
+        for attr, pkg in nixpkgs_packages.items():
+            for desktop_id in pkg.desktop_ids:
+                self.by_desktop_id[desktop_id.removesuffix(".desktop")].append(attr)
+
+            self.attrs.insert(attr)
+
+            # Names are matched on the leaf; the full path stays the identity
+            key = normalize_key(attr.rsplit(".", 1)[-1])
+            if not key:
+                continue
+            self.by_key[key].append(attr)
+            grams = trigrams(key)
+            self.trigram_counts[attr] = len(grams)
+            for gram in grams:
+                self.by_trigram[gram].append(attr)
+
+    @staticmethod
+    def query_keys(flathub_id: str, name: str = "") -> list[str]:
+        """
+        Derive normalized lookup keys from a Flathub ID and display name.
+
+        "org.gnome.TextEditor" yields "texteditor" and "gnometexteditor";
+        the name "OBS Studio" yields "obsstudio".
+        """
+        parts = [p for p in flathub_id.split(".") if p]
+        keys = []
+        if parts:
+            keys.append(normalize_key(parts[-1]))
+        vendor = parts[-2] if len(parts) >= 2 and parts[-2].lower() not in GENERIC_ID_SEGMENTS else ""
+        if vendor:
+            keys.append(normalize_key(vendor + parts[-1]))
+        if name:
+            name_key = "".join(split_tokens(name))
+            keys.append(name_key)
+            if vendor:
+                keys.append(normalize_key(vendor) + name_key)
+        return list(dict.fromkeys(k for k in keys if k))
+
+    def candidates(self, flathub_id: str, name: str = "", limit: int = 5) -> list[Candidate]:
+        """Return up to limit attributes ranked by similarity to the component."""
+        scores: dict[str, float] = {}
+
+        for key in self.query_keys(flathub_id, name):
+            for attr in self.by_key.get(key, ()):
+                scores[attr] = 1.0
+
+            grams = trigrams(key)
+            shared = Counter()
+            for gram in grams:
+                posting = self.by_trigram.get(gram)
+                if posting and len(posting) <= self.MAX_POSTING:
+                    shared.update(posting)
+            for attr, count in shared.items():
+                # Dice coefficient over the two trigram sets
+                similarity = 2 * count / (len(grams) + self.trigram_counts[attr])
+                if similarity > scores.get(attr, 0.0):
+                    scores[attr] = similarity
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [Candidate(attr=attr, similarity=round(sim, 3)) for attr, sim in ranked]
+
+    def desktop_id_candidates(self, component: FlathubComponent) -> list[Candidate]:
+        """Return attributes that ship one of the component's desktop IDs."""
+        desktop_ids = [component.id, *(d.removesuffix(".desktop") for d in component.launchables)]
+        attrs = dict.fromkeys(attr for d in desktop_ids for attr in self.by_desktop_id.get(d, ()))
+        if not attrs:
+            return []
+
+        keys = [trigrams(key) for key in self.query_keys(component.id, component.name)]
+        candidates = []
+        for attr in attrs:
+            attr_grams = trigrams(normalize_key(attr))
+            similarity = max(
+                (2 * len(grams & attr_grams) / (len(grams) + len(attr_grams)) for grams in keys),
+                default=0.0,
+            )
+            candidates.append(Candidate(attr=attr, similarity=round(similarity, 3)))
+        return candidates
+
+
+# Contribution of each signal to a mapping's confidence. A name match alone
+# scores like the old exact-name heuristic (0.8) and a shipped desktop ID
+# alone is enough for a mapping; agreeing metadata raises the score and
+# contradicting metadata lowers it.
+SCORE_WEIGHTS = {
+    "name": 0.8,
+    "desktop_id": 0.6,
+    "homepage": 0.15,
+    "homepage_mismatch": -0.2,
+    "license": 0.03,
+    "license_mismatch": -0.05,
+    "version": 0.02,
+}
+
+# Minimum confidence for a non-curated candidate to become a mapping
+MIN_MAPPING_SCORE = 0.6
+
+
+def normalize_homepage(url: str | None) -> str | None:
+    """Reduce a homepage URL to host and path for comparison."""
+    if not url:
+        return None
+    parts = urllib.parse.urlsplit(url.strip().lower())
+    host = parts.netloc.removeprefix("www.")
+    path = parts.path.rstrip("/")
+    return f"{host}{path}" if host else None
+
+
+def normalize_license(expression: str | None) -> frozenset[str]:
+    """Split an SPDX-ish license expression into comparable license IDs."""
+    if not expression:
+        return frozenset()
+    ids = set()
+    for token in re.split(r"\s+(?:AND|OR|WITH)\s+|[()]|\s*[;,/]\s*", expression):
+        token = token.strip().lower()
+        if not token or token.startswith("licenseref"):
+            continue
+        ids.add(token.removesuffix("-only").removesuffix("-or-later").removesuffix("+"))
+    return frozenset(ids)
+
+
+def version_key(version: str | None) -> tuple[int, ...]:
+    """Leading numeric components of a version string, e.g. "1.2.3-rc1" -> (1, 2, 3)."""
+    if not version:
+        return ()
+    return tuple(int(n) for n in re.findall(r"\d+", version.split("-")[0])[:3])
+
+
+@dataclass(frozen=True)
+class MatchFeatures:
+    """Per-record fields normalized once for pairwise scoring."""
+
+    homepage: str | None
+    licenses: frozenset[str]
+    version: tuple[int, ...]
+    desktop_ids: frozenset[str]
 
-        # Try fuzzy matching by name
-        # Extract the app name from the ID (e.g., "org.mozilla.firefox" -> "firefox")
-        id_parts = flathub_id.split(".")
-        app_name = id_parts[-1].lower() if id_parts else ""
 
-        if app_name and app_name in nixpkgs_packages:
-            pkg = nixpkgs_packages[app_name]
+class MappingScorer:
+    """
+    Score (component, candidate) pairs from several independent signals.
+
+    Features for each component and package are normalized once and
+    memoized, so scoring a batch of tens of thousands of pairs is a handful
+    of set and tuple comparisons per pair.
+    """
+
+    def __init__(self, nixpkgs_packages: dict[str, NixPackage], weights: dict[str, float] = SCORE_WEIGHTS):
+        self.nixpkgs_packages = nixpkgs_packages
+        self.weights = weights
+        self._component_features: dict[str, MatchFeatures] = {}
+        self._package_features: dict[str, MatchFeatures] = {}
+
+    def component_features(self, component: FlathubComponent) -> MatchFeatures:
+        features = self._component_features.get(component.id)
+        if features is None:
+            desktop_ids = {component.id, *(d.removesuffix(".desktop") for d in component.launchables)}
+            features = MatchFeatures(
+                homepage=normalize_homepage(component.homepage),
+                licenses=normalize_license(component.license),
+                version=version_key(component.version),
+                desktop_ids=frozenset(desktop_ids),
+            )
+            self._component_features[component.id] = features
+        return features
+
+    def package_features(self, attr: str) -> MatchFeatures:
+        features = self._package_features.get(attr)
+        if features is None:
+            pkg = self.nixpkgs_packages[attr]
+            features = MatchFeatures(
+                homepage=normalize_homepage(pkg.homepage),
+                licenses=normalize_license(pkg.license),
+                version=version_key(pkg.version),
+                desktop_ids=frozenset(d.removesuffix(".desktop") for d in pkg.desktop_ids),
+            )
+            self._package_features[attr] = features
+        return features
+
+    def score(self, component: FlathubComponent, candidate: Candidate) -> float:
+        """Combine all signals for one pair into a confidence in [0, 1]."""
+        w = self.weights
+        comp = self.component_features(component)
+        pkg = self.package_features(candidate.attr)
+
+        score = w["name"] * candidate.similarity
+        if comp.desktop_ids & pkg.desktop_ids:
+            score += w["desktop_id"]
+        if comp.homepage and pkg.homepage:
+            score += w["homepage"] if comp.homepage == pkg.homepage else w["homepage_mismatch"]
+        if comp.licenses and pkg.licenses:
+            score += w["license"] if comp.licenses & pkg.licenses else w["license_mismatch"]
+        if comp.version and pkg.version:
+            if comp.version[:2] == pkg.version[:2]:
+                score += w["version"]
+            elif comp.version[0] == pkg.version[0]:
+                score += w["version"] / 2
+
+        return round(min(max(score, 0.0), 1.0), 3)
+
+    def score_pairs(self, pairs: list[tuple[FlathubComponent, Candidate]]) -> list[float]:
+        """Score a batch of pairs."""
+        return [self.score(component, candidate) for component, candidate in pairs]
+
+
+def create_mapping(
+    flathub_components: dict[str, FlathubComponent],
+    nixpkgs_packages: dict[str, NixPackage],
+    desktop_id_mapping: dict[str, str],
+    index: PackageIndex | None = None,
+    overrides: OverrideIndex | None = None,
+    min_score: float = MIN_MAPPING_SCORE,
+) -> list[Mapping]:
+    """
+    Create mappings between Flathub components and nixpkgs packages.
+
+    Components pinned by custom.json overrides, then curated desktop IDs,
+    always win with confidence 1.0. Every other component gets name
+    candidates from the package index (built here if not supplied), which
+    are scored in one batch by MappingScorer; the best one is kept if it
+    reaches min_score.
+
+    Returns:
+        List of Mapping objects.
+    """
+    print("Creating mappings...")
+    mappings = []
+    pairs: list[tuple[FlathubComponent, Candidate]] = []
+    if index is None:
+        index = PackageIndex(nixpkgs_packages)
+    scorer = MappingScorer(nixpkgs_packages)
+
+    for flathub_id, component in flathub_components.items():
+        # Check if we have a direct mapping; an override attr that is not a
+        # known package falls back to the curated one
+        direct = (overrides.attr_for(flathub_id) if overrides else None, desktop_id_mapping.get(flathub_id))
+        nixpkgs_attr = next((attr for attr in direct if attr in nixpkgs_packages), None)
+        if nixpkgs_attr is not None:
+            pkg = nixpkgs_packages[nixpkgs_attr]
             mappings.append(
                 Mapping(
                     flathub_id=flathub_id,
-                    nixpkgs_attr=app_name,
+                    nixpkgs_attr=nixpkgs_attr,
                     nixpkgs_version=pkg.version,
-                    confidence=0.8,
+                    confidence=1.0,
                 )
             )
+            continue
+
+        # Gather name candidates; attrs whose leaf equals the last ID segment
+        # (e.g., "org.mozilla.firefox" -> "firefox") are always included,
+        # including every same-named leaf in nested package sets
+        id_parts = flathub_id.split(".")
+        app_name = id_parts[-1].lower() if id_parts else ""
+
+        candidates = [
+            c for c in index.candidates(flathub_id, component.name) if c.similarity >= FUZZY_MATCH_THRESHOLD
+        ]
+        for attr in index.attrs.leaf(app_name):
+            if all(c.attr != attr for c in candidates):
+                candidates.append(Candidate(attr=attr, similarity=1.0))
+        # Packages shipping the component's desktop file are candidates regardless of name
+        for candidate in index.desktop_id_candidates(component):
+            if all(c.attr != candidate.attr for c in candidates):
+                candidates.append(candidate)
+        for candidate in candidates:
+            pairs.append((component, candidate))
+
+    # Score every candidate pair in one batch, then keep the best per component
+    best: dict[str, tuple[float, bool, int, str]] = {}
+    for (component, candidate), score in zip(pairs, scorer.score_pairs(pairs)):
+        # Prefer higher scores, then exact attr matches, then top-level over
+        # nested attrs, then alphabetical order
+        key = (
+            -score,
+            candidate.attr != component.id.split(".")[-1].lower(),
+            candidate.attr.count("."),
+            candidate.attr,
+        )
+        if component.id not in best or key < best[component.id]:
+            best[component.id] = key
+
+    for flathub_id, (neg_score, _inexact, _depth, attr) in best.items():
+        if -neg_score < min_score:
+            continue
+        mappings.append(
+            Mapping(
+                flathub_id=flathub_id,
+                nixpkgs_attr=attr,
+                nixpkgs_version=nixpkgs_packages[attr].version,
+                confidence=-neg_score,
+            )
+        )
 
     print(f"Created {len(mappings)} mappings")
     return mappings
 
 
-def download_icon(icon_url: str, output_dir: Path, component_id: str, size: str = "128x128") -> Path | None:
-    """Download an icon from Flathub."""
-    if not icon_url:
-        return None
+def is_vector_icon(icon_url: str) -> bool:
+    """Whether an icon is an SVG, which is not shipped as a cached icon."""
+    return urllib.parse.urlsplit(icon_url).path.endswith(".svg")
 
-    icons_dir = output_dir / "icons" / size
-    icons_dir.mkdir(parents=True, exist_ok=True)
 
+def icon_path_for(icon_url: str, output_dir: Path, component_id: str, size: str = "128x128") -> Path:
+    """Return the local path an icon is stored at."""
     # Determine extension from URL
     ext = ".png"
     if icon_url.endswith(".svg"):
         ext = ".svg"
 
-    icon_path = icons_dir / f"{component_id}{ext}"
+    return output_dir / "icons" / size / f"{component_id}{ext}"
 
-    if icon_path.exists():
-        return icon_path
 
-    try:
-        urllib.request.urlretrieve(icon_url, icon_path)
-        return icon_path
-    except Exception as e:
-        print(f"  Warning: Failed to download icon for {component_id}: {e}")
-        return None
+def proxy_auth_headers(proxy: urllib.parse.SplitResult) -> dict[str, str]:
+    """Proxy-Authorization for credentials in a proxy URL, if it has any."""
+    if proxy.username is None:
+        return {}
+    credentials = f"{urllib.parse.unquote(proxy.username)}:{urllib.parse.unquote(proxy.password or '')}"
+    return {"Proxy-Authorization": f"Basic {base64.b64encode(credentials.encode()).decode()}"}
+
+
+class IconDownloader:
+    """
+    Download icons concurrently over pooled keep-alive connections.
+
+    Each worker thread keeps one persistent HTTP(S) connection per host, so
+    thousands of icons from the same CDN cost a handful of TLS handshakes
+    instead of one per icon. Use as a context manager; submit() returns a
+    future resolving to the icon path, or None on failure (failures are
+    reported as warnings).
+
+    Proxies are taken from the environment (http_proxy, https_proxy,
+    no_proxy) as urllib does: HTTPS is tunnelled with CONNECT, plain HTTP
+    is requested from the proxy by absolute URL.
+    """
+
+    MAX_REDIRECTS = 5
+
+    def __init__(self, output_dir: Path, max_workers: int = 8, size: str = "128x128"):
+        self.output_dir = output_dir
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._proxies = urllib.request.getproxies()
+
+    def __enter__(self) -> "IconDownloader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Wait for pending downloads and close all pooled connections."""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    def submit(self, icon_url: str, component_id: str) -> Future:
+        """Queue an icon download."""
+        return self._executor.submit(self._download, icon_url, component_id)
+
+    def _download(self, icon_url: str, component_id: str) -> Path | None:
+        icon_path = icon_path_for(icon_url, self.output_dir, component_id, self.size)
+        if icon_path.exists():
+            return icon_path
+
+        try:
+            icon_path.parent.mkdir(parents=True, exist_ok=True)
+            data = self._get(icon_url)
+            tmp_path = icon_path.with_name(icon_path.name + ".part")
+            tmp_path.write_bytes(data)
+            tmp_path.replace(icon_path)
+            return icon_path
+        except Exception as e:
+            print(f"  Warning: Failed to download icon for {component_id}: {e}")
+            return None
+
+    def _proxy(self, parts: urllib.parse.SplitResult) -> urllib.parse.SplitResult | None:
+        """The proxy configured for a URL, unless no_proxy exempts its host."""
+        proxy = self._proxies.get(parts.scheme)
+        if not proxy or urllib.request.proxy_bypass(parts.hostname or ""):
+            return None
+        if "://" not in proxy:
+            proxy = f"http://{proxy}"
+        return urllib.parse.urlsplit(proxy)
+
+    def _connection(self, parts: urllib.parse.SplitResult, fresh: bool = False) -> http.client.HTTPConnection:
+        pool = getattr(self._local, "pool", None)
+        if pool is None:
+            pool = self._local.pool = {}
+
+        key = (parts.scheme, parts.netloc)
+        conn = pool.get(key)
+        if conn is not None and fresh:
+            conn.close()
+            conn = None
+        if conn is None:
+            proxy = self._proxy(parts)
+            if parts.scheme == "https" and proxy:
+                conn = http.client.HTTPSConnection(proxy.hostname, proxy.port, timeout=30)
+                conn.set_tunnel(parts.hostname, parts.port, headers=proxy_auth_headers(proxy))
+            elif parts.scheme == "https":
+                conn = http.client.HTTPSConnection(parts.netloc, timeout=30)
+            elif parts.scheme == "http" and proxy:
+                conn = http.client.HTTPConnection(proxy.hostname, proxy.port, timeout=30)
+            elif parts.scheme == "http":
+                conn = http.client.HTTPConnection(parts.netloc, timeout=30)
+            else:
+                raise ValueError(f"unsupported URL scheme: {parts.scheme}")
+            pool[key] = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _get(self, url: str) -> bytes:
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            target = parts.path or "/"
+            if parts.query:
+                target += f"?{parts.query}"
+            headers = {}
+            proxy = self._proxy(parts) if parts.scheme == "http" else None
+            if proxy:
+                # A plain HTTP proxy is asked for the absolute URL
+                target = urllib.parse.urlunsplit(parts._replace(path=parts.path or "/", fragment=""))
+                headers = proxy_auth_headers(proxy)
+
+            try:
+                conn = self._connection(parts)
+                conn.request("GET", target, headers=headers)
+                response = conn.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                # The server may have closed an idle keep-alive connection
+                conn = self._connection(parts, fresh=True)
+                conn.request("GET", target, headers=headers)
+                response = conn.getresponse()
+
+            body = response.read()
+            if response.status in (301, 302, 303, 307, 308):
+                url = urllib.parse.urljoin(url, response.getheader("Location", ""))
+                continue
+            if response.status != 200:
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            return body
+
+        raise urllib.error.URLError(f"too many redirects for {url}")
 
 
 def transform_component_xml(
-    component: FlathubComponent, mapping: Mapping, output_dir: Path
-) -> str:
+    component: FlathubComponent,
+    mapping: Mapping,
+    output_dir: Path,
+    override: PackageOverride | None = None,
+) -> ET.Element:
     """
     Transform a Flathub component XML for use with nixpkgs.
 
     Changes:
     - Updates <pkgname> to nixpkgs attribute
     - Updates version
-    - Rewrites icon paths
+    - Rewrites icon paths; icons whose URL cannot be resolved are dropped
     - Sets origin to "nixpkgs"
-    """
-    # Parse the raw XML
-    elem = ET.fromstring(component.raw_xml)
+    - Applies the attr's custom.json override (component ID, icon)
 
-    # Update or add pkgname
-    pkgname = elem.find("pkgname")
-    if pkgname is None:
-        pkgname = ET.SubElement(elem, "pkgname")
-    pkgname.text = mapping.nixpkgs_attr
+    The component's element is built here from its stored source bytes, so
+    only mapped components are ever parsed into trees. The returned element
+    is a new shell around those children: only the rewritten elements are
+    created, everything else (descriptions, screenshots, translations) is
+    taken over as parsed rather than copied.
+    """
+    source = component.parse_element()
+    elem = ET.Element(source.tag, source.attrib)
+    elem.text = source.text
+
+    # Icon filename
+    icon_url = component.icon_url
+    icon_stem = component.id
+    if override:
+        icon_url = override.icon_url or icon_url
+        icon_stem = override.icon_stem(component.id)
+    # Cached catalog icons are 128x128 PNGs; an SVG is published by its URL
+    remote_icon = icon_url is not None and is_vector_icon(icon_url)
+
+    has_pkgname = False
+    has_releases = False
+    has_icon = False
+    for child in source:
+        if child.tag == "id" and override and override.component_id:
+            child = _replacement_element(child, text=override.component_id)
+        elif child.tag == "pkgname":
+            # Update pkgname
+            child = _replacement_element(child, text=mapping.nixpkgs_attr)
+            has_pkgname = True
+        elif child.tag == "releases":
+            # Replace existing releases with the nixpkgs version
+            child = _replacement_element(child)
+            ET.SubElement(child, "release", version=mapping.nixpkgs_version)
+            has_releases = True
+        elif child.tag == "icon" and child.get("type", "") in ("remote", "cached"):
+            if icon_url is None:
+                # A cached icon of a source without an icons URL is never
+                # fetched, so there is no local file to point at
+                continue
+            child = _icon_element(child, icon_url if remote_icon else f"{icon_stem}.png", remote_icon)
+            has_icon = True
+        elif child.tag == "icon" and override and override.icon_url:
+            # Stock icons give way to the override icon
+            continue
+        elem.append(child)
 
-    # Add/update releases with nixpkgs version
-    releases = elem.find("releases")
-    if releases is None:
+    if override and override.icon_url and not has_icon:
+        elem.append(_icon_element(ET.Element("icon"), icon_url if remote_icon else f"{icon_stem}.png", remote_icon))
+    if not has_pkgname:
+        ET.SubElement(elem, "pkgname").text = mapping.nixpkgs_attr
+    if not has_releases:
         releases = ET.SubElement(elem, "releases")
-    # Clear existing releases and add nixpkgs version
-    releases.clear()
-    release = ET.SubElement(releases, "release")
-    release.set("version", mapping.nixpkgs_version)
-
-    # Update icon references to local paths
-    for icon in elem.findall("icon"):
-        icon_type = icon.get("type", "")
-        if icon_type in ("remote", "cached"):
-            # Change to cached type with local path
-            icon.set("type", "cached")
-            icon.set("width", "128")
-            icon.set("height", "128")
-            # Icon filename
-            ext = ".png"
-            if component.icon_url and component.icon_url.endswith(".svg"):
-                ext = ".svg"
-            icon.text = f"{component.id}{ext}"
-
-    return ET.tostring(elem, encoding="unicode")
+        ET.SubElement(releases, "release", version=mapping.nixpkgs_version)
+
+    return elem
+
+
+def _icon_element(child: ET.Element, text: str, remote: bool) -> ET.Element:
+    """Stand-in for an <icon>: a remote URL, or a cached 128x128 file name."""
+    if remote:
+        icon = ET.Element("icon", type="remote")
+        icon.text = text
+        icon.tail = child.tail
+        return icon
+    icon = _replacement_element(child, text=text)
+    icon.attrib.update(type="cached", width="128", height="128")
+    return icon
+
+
+def _replacement_element(child: ET.Element, text: str | None = None) -> ET.Element:
+    """Create an empty stand-in for child, keeping its tag, attributes and tail."""
+    replacement = ET.Element(child.tag, child.attrib)
+    replacement.text = text
+    replacement.tail = child.tail
+    return replacement
+
+
+class _TeeWriter:
+    """Binary writer that forwards every write to several sinks."""
+
+    def __init__(self, *sinks: BinaryIO):
+        self.sinks = sinks
+
+    def write(self, data: bytes) -> int:
+        for sink in self.sinks:
+            sink.write(data)
+        return len(data)
+
+
+@contextmanager
+def open_catalog_sink(catalog_path: Path, write_plain: bool = True) -> Iterator[BinaryIO]:
+    """
+    Open a binary sink that writes catalog_path.gz and, optionally, catalog_path.
+
+    Both files are produced in a single pass over the serialized catalog.
+    The gzip header carries a fixed mtime, so identical catalogs compress
+    to identical bytes.
+    """
+    with ExitStack() as stack:
+        sinks = [stack.enter_context(gzip.GzipFile(f"{catalog_path}.gz", "wb", mtime=0))]
+        if write_plain:
+            sinks.append(stack.enter_context(open(catalog_path, "wb")))
+        yield _TeeWriter(*sinks)
+
+
+def component_fingerprint(
+    component: FlathubComponent, mapping: Mapping, override: PackageOverride | None = None
+) -> str:
+    """
+    Fingerprint everything that determines a component's catalog output.
+
+    Combines the source XML hash and resolved icon URL with the mapped
+    nixpkgs attr and version and any override of the attr, so a component
+    is only re-transformed when one of them changes.
+    """
+    parts = [
+        str(FRAGMENT_FORMAT),
+        component.xml_hash,
+        component.icon_url or "",
+        mapping.nixpkgs_attr,
+        mapping.nixpkgs_version,
+    ]
+    if override:
+        parts += [override.component_id or "", override.icon_url or "", override.output_icon or ""]
+    key = "\0".join(parts)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class CatalogWriter:
+    """
+    Incrementally write an AppStream <components> catalog.
+
+    The header is written on construction, each component is indented and
+    serialized as soon as it is passed in, and close() writes the footer.
+    Only one component is held in memory at a time.
+    """
+
+    def __init__(self, sink: BinaryIO, origin: str, version: str = "0.16"):
+        self.sink = sink
+        sink.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        sink.write(
+            f"<components version={quoteattr(version)} origin={quoteattr(origin)}>\n".encode()
+        )
+
+    @staticmethod
+    def render_component(elem: ET.Element) -> bytes:
+        """Serialize one <component> element at the first indentation level."""
+        elem.tail = None
+        ET.indent(elem, space="  ", level=1)
+        return b"  " + ET.tostring(elem, encoding="utf-8") + b"\n"
+
+    def write_component(self, elem: ET.Element) -> bytes:
+        """Serialize and write one <component> element, returning the bytes written."""
+        fragment = self.render_component(elem)
+        self.sink.write(fragment)
+        return fragment
+
+    def write_fragment(self, fragment: bytes) -> None:
+        """Write a component previously produced by render_component."""
+        self.sink.write(fragment)
+
+    def close(self) -> None:
+        """Write the closing </components> tag."""
+        self.sink.write(b"</components>\n")
+
+
+def render_component_fragment(
+    component: FlathubComponent, mapping: Mapping, output_dir: Path, override: PackageOverride | None = None
+) -> tuple[bytes | None, str | None]:
+    """
+    Transform and serialize one component for the catalog.
+
+    Returns:
+        (fragment, None) on success, (None, error message) on failure.
+    """
+    try:
+        elem = transform_component_xml(component, mapping, output_dir, override)
+        return CatalogWriter.render_component(elem), None
+    except Exception as e:
+        return None, str(e)
+
+
+# Per-worker state for the transformation process pool
+_worker_components: dict[str, FlathubComponent] = {}
+_worker_output_dir: Path | None = None
+_worker_overrides: OverrideIndex | None = None
+
+
+def _init_transform_worker(
+    components: dict[str, FlathubComponent], output_dir: Path, overrides: OverrideIndex | None = None
+) -> None:
+    global _worker_components, _worker_output_dir, _worker_overrides
+    _worker_components = components
+    _worker_output_dir = output_dir
+    _worker_overrides = overrides
+
+
+def _render_in_worker(mapping: Mapping) -> tuple[bytes | None, str | None]:
+    override = _worker_overrides.get(mapping.nixpkgs_attr) if _worker_overrides else None
+    return render_component_fragment(_worker_components[mapping.flathub_id], mapping, _worker_output_dir, override)
+
+
+def render_fragments(
+    pairs: list[tuple[FlathubComponent, Mapping]],
+    output_dir: Path,
+    jobs: int = 1,
+    overrides: OverrideIndex | None = None,
+) -> Iterator[tuple[bytes | None, str | None]]:
+    """
+    Render catalog fragments for pairs, in order.
+
+    With jobs <= 1 fragments are rendered lazily in this process. Otherwise
+    the work is submitted immediately to a pool of jobs processes, sharded
+    into chunks; the components are handed to each worker once at startup
+    (inherited without copying where fork is available) and only the small
+    Mapping objects travel per task. Results come back in input order.
+    """
+    if jobs <= 1 or len(pairs) < 2:
+        return (
+            render_component_fragment(
+                component, mapping, output_dir, overrides.get(mapping.nixpkgs_attr) if overrides else None
+            )
+            for component, mapping in pairs
+        )
+
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    executor = ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=context,
+        initializer=_init_transform_worker,
+        initargs=({component.id: component for component, _ in pairs}, output_dir, overrides),
+    )
+    chunksize = max(1, len(pairs) // (jobs * 4))
+    results = executor.map(_render_in_worker, [mapping for _, mapping in pairs], chunksize=chunksize)
+    # Workers keep running until every submitted chunk is done
+    executor.shutdown(wait=False)
+    return results
+
+
+@dataclass
+class GeneratorEntry:
+    """One component written by the Rust nixos-appstream-generator."""
+
+    component_id: str  # <id> without a .desktop suffix
+    pkgname: str  # nixpkgs attribute the metainfo was generated from
+    path: Path  # output/metadata/<pkg>::<id>.xml
+    icons: list[tuple[str, str]] = field(default_factory=list)  # (size, filename) of cached icons
+
+    def load(self) -> ET.Element:
+        """Parse the component; only done when it is written to the catalog."""
+        return ET.parse(self.path).getroot()
+
+
+def read_generator_entry(path: Path) -> GeneratorEntry | None:
+    """
+    Read the keys of one generator metainfo file.
+
+    Returns:
+        The entry, or None if the file is not a usable component.
+    """
+    try:
+        root = ET.parse(path).getroot()
+    except ET.ParseError as e:
+        print(f"  Warning: Skipping unparsable generator metainfo {path.name}: {e}")
+        return None
+    if root.tag != "component":
+        return None
+
+    # The generator names its files <pkg>::<id>.xml and injects <pkgname>
+    pkgname = root.findtext("pkgname", "").strip() or path.stem.partition("::")[0]
+    comp_id = root.findtext("id", "").strip().removesuffix(".desktop")
+    if not comp_id or not pkgname:
+        return None
+
+    icons = [
+        (f"{icon.get('width')}x{icon.get('height')}", icon.text.strip())
+        for icon in root.findall("icon")
+        if icon.get("type") == "cached" and icon.text and icon.get("width") and icon.get("height")
+    ]
+    return GeneratorEntry(component_id=comp_id, pkgname=pkgname, path=path, icons=icons)
+
+
+class GeneratorIndex:
+    """
+    Index of the Rust generator's output directory by component ID and pkgname.
+
+    The generator writes metainfo to <dir>/metadata/*.xml and icons to
+    <dir>/icons/<size>/. Only the keys and icon names are kept in memory;
+    each component is parsed again when it is written out.
+    """
+
+    def __init__(self, output_dir: Path, entries: Iterable[GeneratorEntry]):
+        self.output_dir = output_dir
+        self.by_id: dict[str, GeneratorEntry] = {}
+        self.by_pkgname: dict[str, list[GeneratorEntry]] = defaultdict(list)
+        for entry in entries:
+            if entry.component_id in self.by_id:
+                continue
+            self.by_id[entry.component_id] = entry
+            self.by_pkgname[entry.pkgname].append(entry)
+
+    @classmethod
+    def scan(cls, output_dir: Path, jobs: int = 8) -> "GeneratorIndex":
+        """Read every metainfo file under output_dir/metadata."""
+        paths = sorted((output_dir / "metadata").glob("*.xml"))
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            entries = [entry for entry in executor.map(read_generator_entry, paths) if entry is not None]
+        print(f"Indexed {len(entries)} components from generator output {output_dir}")
+        return cls(output_dir, entries)
+
+    def match(self, component_id: str, attr: str) -> GeneratorEntry | None:
+        """
+        Find the native component describing the same app as a Flathub mapping.
+
+        Matches on component ID first, then on pkgname when the package has
+        exactly one native component.
+        """
+        entry = self.by_id.get(component_id)
+        if entry is None:
+            candidates = self.by_pkgname.get(attr, [])
+            if len(candidates) == 1:
+                entry = candidates[0]
+        return entry
+
+    def copy_icons(self, entry: GeneratorEntry, output_dir: Path) -> int:
+        """
+        Copy an entry's icons into the catalog's icon directory.
+
+        Returns:
+            Number of icons available in output_dir.
+        """
+        copied = 0
+        for size, name in entry.icons:
+            src_path = self.output_dir / "icons" / size / name
+            dest = output_dir / "icons" / size / name
+            if not dest.exists():
+                if not src_path.exists():
+                    continue
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(src_path, dest)
+            copied += 1
+        return copied
+
+
+def _field_key(child: ET.Element) -> tuple[str, str | None]:
+    """Identify a component field; <url> elements are distinguished by type."""
+    return child.tag, child.get("type") if child.tag == "url" else None
+
+
+def _translated_field_key(child: ET.Element) -> tuple[str, str | None, str | None]:
+    """Identify a field in one language, so other translations can be filled in."""
+    return (*_field_key(child), child.get(XML_LANG))
+
+
+def merge_native_component(
+    native: ET.Element,
+    flathub: ET.Element,
+    key: Callable[[ET.Element], Hashable] = _field_key,
+) -> ET.Element:
+    """
+    Fill the gaps of a generator-produced component from its Flathub counterpart.
+
+    Every field present in the nixpkgs-native metainfo is kept as is,
+    including all of its translations; fields it lacks are taken from the
+    transformed Flathub component. key decides what counts as the same
+    field.
+
+    Returns:
+        The native element, extended in place.
+    """
+    present = {key(child) for child in native}
+    for child in flathub:
+        if key(child) not in present:
+            native.append(child)
+    return native
+
+
+def overlay_component(base: FlathubComponent, override: FlathubComponent) -> FlathubComponent:
+    """
+    Lay override metainfo over the catalog component it describes.
+
+    Fields the override provides win, per language; everything else (icon,
+    screenshots, other translations) is kept from the catalog. A catalog
+    icon keeps the URL it was resolved to by its source.
+
+    Returns:
+        The combined component.
+    """
+    elem = merge_native_component(override.parse_element(), base.parse_element(), key=_translated_field_key)
+    component = _component_from_element(elem, None)
+    if component.icon_url is None:
+        component = replace(component, icon_url=base.icon_url)
+    return component
 
 
 def generate_appstream_catalog(
@@ -526,90 +2675,365 @@ def generate_appstream_catalog(
     flathub_components: dict[str, FlathubComponent],
     output_dir: Path,
     download_icons: bool = True,
+    icon_jobs: int = 8,
+    write_plain: bool = True,
+    fragment_dir: Path | None = None,
+    jobs: int = 1,
+    arch: str = DEFAULT_ARCH,
+    generator: GeneratorIndex | None = None,
+    overrides: OverrideIndex | None = None,
 ) -> None:
     """
     Generate the final AppStream catalog XML.
+
+    Icon downloads run on a pool of icon_jobs threads in the background
+    while components are transformed. Components are sorted by ID so an
+    unchanged catalog produces byte-identical output. The uncompressed
+    catalog is only written when write_plain is set.
+
+    With fragment_dir, each serialized component is stored under its
+    fingerprint (see component_fingerprint). Components whose fingerprint
+    is unchanged since the last run reuse the stored fragment and skip
+    transformation and icon downloads.
+
+    With jobs > 1, transformation is sharded across a process pool (see
+    render_fragments); output order is unaffected.
+
+    With generator, the Rust generator's components are streamed into the
+    same catalog. A Flathub component describing the same app is merged
+    into the native one (see merge_native_component) instead of being
+    written separately. Its icons are copied into output_dir along with
+    the downloads, so only when download_icons is set.
+
+    With overrides, each mapped attr's custom.json entry is applied during
+    transformation, and its fetched icon replaces the Flathub download.
     """
     output_dir.mkdir(parents=True, exist_ok=True)
 
     print(f"Generating AppStream catalog with {len(mappings)} components...")
 
-    # Create XML structure
-    root = ET.Element("components")
-    root.set("version", "0.16")
-    root.set("origin", "nixpkgs-flathub")
+    xml_dir = output_dir / "xml"
+    xml_dir.mkdir(parents=True, exist_ok=True)
+    catalog_path = xml_dir / f"nixpkgs-flathub_{arch}.xml"
+
+    if fragment_dir:
+        fragment_dir.mkdir(parents=True, exist_ok=True)
 
-    icon_count = 0
-    for mapping in mappings:
+    # Native components not claimed by a Flathub mapping are written as is
+    natives = dict(generator.by_id) if generator else {}
+
+    # Decide up front which components can reuse a cached fragment; merged
+    # components are always rebuilt from both sources
+    work: list[tuple[Mapping, FlathubComponent, Path | None, bool, GeneratorEntry | None]] = []
+    for mapping in sorted(mappings, key=lambda m: m.flathub_id):
         component = flathub_components.get(mapping.flathub_id)
         if not component:
             continue
+        native = generator.match(component.id, mapping.nixpkgs_attr) if generator else None
+        if native is not None:
+            native = natives.pop(native.component_id, None)
+        fragment_path = None
+        if fragment_dir and native is None:
+            override = overrides.get(mapping.nixpkgs_attr) if overrides else None
+            fragment_path = fragment_dir / f"{component_fingerprint(component, mapping, override)}.xml"
+        work.append(
+            (mapping, component, fragment_path, fragment_path is not None and fragment_path.exists(), native)
+        )
+    reused = sum(1 for _m, _c, _p, cached, _n in work if cached)
+    merged = sum(1 for *_, native in work if native is not None)
+
+    # Start transformation first: with a process pool, workers are forked
+    # before any icon download threads exist
+    rendered = render_fragments(
+        [(component, mapping) for mapping, component, _path, cached, native in work if not (cached or native)],
+        output_dir,
+        jobs=jobs,
+        overrides=overrides,
+    )
 
-        # Download icon if requested
-        if download_icons and component.icon_url:
-            icon_path = download_icon(component.icon_url, output_dir, component.id)
-            if icon_path:
-                icon_count += 1
+    # Interleave native-only components so the catalog stays sorted by ID
+    entries: list[tuple] = sorted(
+        [(item[0].flathub_id, item) for item in work]
+        + [(entry.component_id, entry) for entry in natives.values()],
+        key=lambda pair: pair[0],
+    )
 
-        # Transform and add component
-        try:
-            transformed_xml = transform_component_xml(component, mapping, output_dir)
-            component_elem = ET.fromstring(transformed_xml)
-            root.append(component_elem)
-        except Exception as e:
-            print(f"  Warning: Failed to transform {component.id}: {e}")
+    icon_futures = []
+    icon_count = 0
+    copied_icons = 0
+    with (
+        IconDownloader(output_dir, max_workers=icon_jobs) as downloader,
+        open_catalog_sink(catalog_path, write_plain=write_plain) as sink,
+    ):
+        # Queue icon downloads if requested; unchanged components only
+        # fetch icons that are missing
+        if download_icons:
+            for mapping, component, _path, cached, native in work:
+                if native is not None and native.icons:
+                    continue
+                override = overrides.get(mapping.nixpkgs_attr) if overrides else None
+                icon_stem = override.icon_stem(component.id) if override else component.id
+                icon_url = (override.icon_url if override else None) or component.icon_url
+                if not icon_url or is_vector_icon(icon_url):
+                    # SVG icons are published by URL (see transform_component_xml)
+                    continue
+                if override and override.icon_path:
+                    # Already fetched into the cache; refresh the copy when it changed
+                    dest = icon_path_for(override.icon_url, output_dir, icon_stem)
+                    if not dest.exists() or dest.stat().st_mtime != override.icon_path.stat().st_mtime:
+                        dest.parent.mkdir(parents=True, exist_ok=True)
+                        shutil.copy2(override.icon_path, dest)
+                    icon_count += 1
+                    continue
+                if cached and icon_path_for(component.icon_url, output_dir, icon_stem).exists():
+                    icon_count += 1
+                else:
+                    icon_futures.append(downloader.submit(component.icon_url, icon_stem))
+
+        writer = CatalogWriter(sink, origin="nixpkgs-flathub")
+        for _comp_id, item in entries:
+            if isinstance(item, GeneratorEntry):
+                try:
+                    writer.write_component(item.load())
+                except ET.ParseError as e:
+                    print(f"  Warning: Failed to read {item.path.name}: {e}")
+                    continue
+                if download_icons:
+                    copied_icons += generator.copy_icons(item, output_dir)
+                continue
 
-    # Write catalog
-    xml_dir = output_dir / "xml"
-    xml_dir.mkdir(parents=True, exist_ok=True)
+            mapping, component, fragment_path, cached, native = item
+            if native is not None:
+                try:
+                    override = overrides.get(mapping.nixpkgs_attr) if overrides else None
+                    flathub_elem = transform_component_xml(component, mapping, output_dir, override)
+                    writer.write_component(merge_native_component(native.load(), flathub_elem))
+                except Exception as e:
+                    print(f"  Warning: Failed to merge {component.id} with {native.path.name}: {e}")
+                    continue
+                if download_icons:
+                    copied_icons += generator.copy_icons(native, output_dir)
+                continue
 
-    catalog_path = xml_dir / "nixpkgs-flathub_x86_64.xml"
-    tree = ET.ElementTree(root)
-    ET.indent(tree, space="  ")
-    tree.write(catalog_path, encoding="unicode", xml_declaration=True)
+            if cached:
+                writer.write_fragment(fragment_path.read_bytes())
+                continue
 
-    # Compress
-    with open(catalog_path, "rb") as f_in:
-        with gzip.open(f"{catalog_path}.gz", "wb") as f_out:
-            f_out.write(f_in.read())
+            # Write the transformed component
+            fragment, error = next(rendered)
+            if fragment is None:
+                print(f"  Warning: Failed to transform {component.id}: {error}")
+                continue
+            writer.write_fragment(fragment)
+            if fragment_path:
+                # Reuse only checks that a fragment exists, so never leave a partial one
+                tmp_path = fragment_path.with_name(fragment_path.name + ".part")
+                tmp_path.write_bytes(fragment)
+                tmp_path.replace(fragment_path)
+        writer.close()
+
+    icon_count += sum(1 for future in icon_futures if future.result())
+
+    if fragment_dir:
+        # Drop fragments of components that changed or disappeared, and
+        # partial writes of an interrupted run
+        used_fragments = {fragment_path.name for _m, _c, fragment_path, _cached, _n in work if fragment_path}
+        for stale in fragment_dir.glob("*.xml*"):
+            if stale.name not in used_fragments:
+                stale.unlink()
+        print(f"Reused {reused} unchanged components, transformed {len(work) - reused - merged}")
+    if generator:
+        print(f"Merged {merged} components with generator output, added {len(natives)} nixpkgs-native components")
+        if download_icons:
+            print(f"Copied {copied_icons} generator icons")
 
     print(f"Generated catalog: {catalog_path}.gz")
     print(f"Downloaded {icon_count} icons")
 
 
+def confidence_bucket(confidence: float) -> str:
+    """Histogram bucket label for a confidence, e.g. 0.84 -> "0.8-0.9"."""
+    if confidence >= 1.0:
+        return "1.0"
+    low = math.floor(confidence * 10) / 10
+    return f"{low:.1f}-{low + 0.1:.1f}"
+
+
+def coverage_table(totals: Counter, mapped: Counter) -> dict[str, dict]:
+    """Per-key component/mapped counts, largest groups first."""
+    return {
+        key: {
+            "components": total,
+            "mapped": mapped[key],
+            "coverage_percent": round(mapped[key] / total * 100, 1),
+        }
+        for key, total in sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+    }
+
+
+def write_json_member(f: IO[str], key: str, value: Any, last: bool = False) -> None:
+    """Write one member of a top-level JSON object with two-space indentation."""
+    encoded = json.dumps(value, indent=2).replace("\n", "\n  ")
+    f.write(f"  {json.dumps(key)}: {encoded}{'' if last else ','}\n")
+
+
 def generate_mapping_report(
     mappings: list[Mapping],
     flathub_components: dict[str, FlathubComponent],
     output_dir: Path,
 ) -> None:
-    """Generate a JSON report of the mappings."""
-    report = {
-        "total_flathub_components": len(flathub_components),
-        "total_mappings": len(mappings),
-        "coverage_percent": len(mappings) / len(flathub_components) * 100 if flathub_components else 0,
-        "mappings": [
-            {
+    """
+    Generate a JSON report of the mappings.
+
+    All statistics come from one pass over the mappings and one over the
+    components, using a set of mapped IDs for membership, and the report is
+    streamed to disk: the mappings list is encoded one entry at a time
+    rather than built as a whole document first.
+    """
+    mapped_ids = {m.flathub_id for m in mappings}
+    histogram = Counter(confidence_bucket(m.confidence) for m in mappings)
+
+    category_totals, category_mapped = Counter(), Counter()
+    license_totals, license_mapped = Counter(), Counter()
+    unmapped_popular = []
+    for position, (comp_id, comp) in enumerate(flathub_components.items()):
+        is_mapped = comp_id in mapped_ids
+        for category in dict.fromkeys(comp.categories):
+            category_totals[category] += 1
+            category_mapped[category] += is_mapped
+        license_id = comp.license or "unknown"
+        license_totals[license_id] += 1
+        license_mapped[license_id] += is_mapped
+        if position < 100 and not is_mapped and len(unmapped_popular) < 20:
+            unmapped_popular.append({"id": comp.id, "name": comp.name})
+
+    total = len(flathub_components)
+    coverage_percent = len(mappings) / total * 100 if total else 0
+
+    report_path = output_dir / "mapping_report.json"
+    with open(report_path, "w") as f:
+        f.write("{\n")
+        write_json_member(f, "total_flathub_components", total)
+        write_json_member(f, "total_mappings", len(mappings))
+        write_json_member(f, "coverage_percent", coverage_percent)
+        write_json_member(f, "confidence_histogram", dict(sorted(histogram.items())))
+        write_json_member(f, "category_coverage", coverage_table(category_totals, category_mapped))
+        write_json_member(f, "license_coverage", coverage_table(license_totals, license_mapped))
+
+        f.write('  "mappings": [')
+        for i, m in enumerate(mappings):
+            component = flathub_components.get(m.flathub_id)
+            entry = {
                 "flathub_id": m.flathub_id,
                 "nixpkgs_attr": m.nixpkgs_attr,
                 "nixpkgs_version": m.nixpkgs_version,
                 "confidence": m.confidence,
-                "flathub_name": flathub_components.get(m.flathub_id, FlathubComponent("", "", "", "", [], [], [], None, None, None, None, "")).name,
+                "flathub_name": component.name if component else "",
             }
-            for m in mappings
-        ],
-        "unmapped_popular": [
-            {"id": comp.id, "name": comp.name}
-            for comp_id, comp in list(flathub_components.items())[:100]
-            if not any(m.flathub_id == comp_id for m in mappings)
-        ][:20],
-    }
+            f.write("," if i else "")
+            f.write("\n    " + json.dumps(entry, indent=2).replace("\n", "\n    "))
+        f.write("\n  ],\n" if mappings else "],\n")
 
-    report_path = output_dir / "mapping_report.json"
-    with open(report_path, "w") as f:
-        json.dump(report, f, indent=2)
+        write_json_member(f, "unmapped_popular", unmapped_popular, last=True)
+        f.write("}")
 
     print(f"Generated mapping report: {report_path}")
-    print(f"Coverage: {report['coverage_percent']:.1f}% ({len(mappings)}/{len(flathub_components)})")
+    print(f"Coverage: {coverage_percent:.1f}% ({len(mappings)}/{total})")
+
+
+PROFILE_MODES = ("timing", "cprofile", "tracemalloc")
+
+
+@dataclass
+class StageStats:
+    """Measurements for one pipeline stage."""
+
+    name: str
+    items: int | None = None
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_mb: float = 0.0  # Process high-water mark at the end of the stage
+    rss_growth_mb: float = 0.0  # How much the stage raised that high-water mark
+    traced_peak_mb: float | None = None  # tracemalloc mode only
+    profile_path: str | None = None  # cprofile mode only
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MiB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+class StageProfiler:
+    """
+    Record wall time, CPU time, peak RSS and item counts per pipeline stage.
+
+    In "cprofile" mode each stage also runs under cProfile, and in
+    "tracemalloc" mode the peak traced Python allocation is recorded.
+    Stages set stage.items inside the with block to report how much they
+    processed.
+    """
+
+    def __init__(self, mode: str | None = None):
+        self.mode = mode
+        self.stages: list[StageStats] = []
+        self._profiles: dict[str, cProfile.Profile] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        stats = StageStats(name=name)
+        self.stages.append(stats)
+
+        profile = None
+        if self.mode == "cprofile":
+            profile = self._profiles[name] = cProfile.Profile()
+        elif self.mode == "tracemalloc":
+            tracemalloc.start()
+
+        rss_before = peak_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile:
+            profile.enable()
+        try:
+            yield stats
+        finally:
+            if profile:
+                profile.disable()
+            stats.wall_seconds = round(time.perf_counter() - wall_start, 4)
+            stats.cpu_seconds = round(time.process_time() - cpu_start, 4)
+            stats.peak_rss_mb = round(peak_rss_mb(), 1)
+            stats.rss_growth_mb = round(max(stats.peak_rss_mb - rss_before, 0.0), 1)
+            if self.mode == "tracemalloc":
+                stats.traced_peak_mb = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+                tracemalloc.stop()
+            if self.mode:
+                print(f"[profile] {name}: {stats.wall_seconds:.2f}s wall, {stats.cpu_seconds:.2f}s CPU, "
+                      f"peak RSS {stats.peak_rss_mb:.0f} MiB")
+
+    def write_report(self, output_dir: Path) -> Path:
+        """Write timing_report.json (and per-stage .prof files) to output_dir."""
+        for stats in self.stages:
+            profile = self._profiles.get(stats.name)
+            if profile:
+                prof_path = output_dir / f"profile-{stats.name}.prof"
+                profile.dump_stats(prof_path)
+                stats.profile_path = prof_path.name
+
+        report = {
+            "mode": self.mode,
+            "total_wall_seconds": round(sum(s.wall_seconds for s in self.stages), 4),
+            "total_cpu_seconds": round(sum(s.cpu_seconds for s in self.stages), 4),
+            "peak_rss_mb": max((s.peak_rss_mb for s in self.stages), default=0.0),
+            "stages": [asdict(s) for s in self.stages],
+        }
+        report_path = output_dir / "timing_report.json"
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print(f"Generated timing report: {report_path}")
+        return report_path
 
 
 def main():
@@ -629,63 +3053,288 @@ def main():
         default=Path("./cache"),
         help="Directory for caching downloaded data",
     )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=24.0,
+        help="Hours before cached downloads are revalidated with the server (default: 24)",
+    )
+    parser.add_argument(
+        "--nixpkgs",
+        type=Path,
+        default=None,
+        help="Local nixpkgs checkout to search and scan for desktop-ID evidence",
+    )
+    parser.add_argument(
+        "--packages-json",
+        type=Path,
+        default=None,
+        help="Read nixpkgs packages from a packages.json(.br) dump instead of running nix search",
+    )
     parser.add_argument(
         "--no-icons",
         action="store_true",
         help="Skip downloading icons",
     )
+    parser.add_argument(
+        "--icon-jobs",
+        type=int,
+        default=8,
+        help="Number of concurrent icon downloads (default: 8)",
+    )
     parser.add_argument(
         "--no-nix-search",
         action="store_true",
         help="Skip nix search (faster, uses only curated mappings)",
     )
+    parser.add_argument(
+        "--scan-store",
+        action="store_true",
+        help="Read desktop files from packages already realized in /nix/store",
+    )
+    parser.add_argument(
+        "--scan-jobs",
+        type=int,
+        default=8,
+        help="Number of threads used to scan store paths and source files (default: 8)",
+    )
+    parser.add_argument(
+        "--source",
+        action="append",
+        dest="sources",
+        type=parse_source_spec,
+        metavar="NAME[=LOCATION[,ICONS_URL]]",
+        help="AppStream source to merge, by known name ("
+        + ", ".join(KNOWN_SOURCES)
+        + ") or NAME=URL/file/metainfo directory; LOCATION may contain {arch}. "
+        "ICONS_URL is the base URL of the catalog's cached icons and may contain {arch}; "
+        "without it, cached icons of the source are dropped. "
+        "Repeat for several; earlier sources win on shared component IDs (default: flathub)",
+    )
+    parser.add_argument(
+        "--custom",
+        type=Path,
+        default=None,
+        metavar="FILE",
+        help=f"Per-package customisation file (default: {CUSTOM_DATA_FILE} if present)",
+    )
+    parser.add_argument(
+        "--generator-output",
+        type=Path,
+        default=None,
+        metavar="DIR",
+        help="Output directory of nixos-appstream-generator (with metadata/ and icons/) "
+        "to merge into the catalog; its fields win over Flathub's",
+    )
+    parser.add_argument(
+        "--arch",
+        action="append",
+        dest="arches",
+        metavar="ARCH",
+        help=f"Flathub architecture to build a catalog for; repeat for several (default: {DEFAULT_ARCH})",
+    )
     parser.add_argument(
         "--mapping-only",
         action="store_true",
         help="Only generate mapping report, don't create catalog",
     )
+    parser.add_argument(
+        "--compressed-only",
+        action="store_true",
+        help="Only write the gzipped catalog, not the uncompressed XML",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Worker processes for component transformation (default: 1, no pool)",
+    )
+    parser.add_argument(
+        "--full-rebuild",
+        action="store_true",
+        help="Re-transform every component instead of reusing unchanged output from the last run",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="timing",
+        choices=PROFILE_MODES,
+        default=None,
+        help="Write per-stage timing_report.json; 'cprofile' also dumps per-stage .prof files, "
+        "'tracemalloc' also records peak Python allocations",
+    )
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=MIN_MAPPING_SCORE,
+        help=f"Minimum mapping confidence for a component to be included in the catalog (default: {MIN_MAPPING_SCORE})",
+    )
 
     args = parser.parse_args()
-
-    # Fetch Flathub data
-    try:
-        xml_path = fetch_flathub_appstream(args.cache_dir)
-    except Exception as e:
-        print(f"Error fetching Flathub data: {e}")
-        sys.exit(1)
-
-    # Parse Flathub components
-    flathub_components = parse_flathub_appstream(xml_path)
+    arches = list(dict.fromkeys(args.arches or [DEFAULT_ARCH]))
+    # Earlier --source entries take precedence
+    specs = args.sources or [FLATHUB_SOURCE]
+    names = [source.name for source in specs]
+    if len(set(names)) != len(names):
+        parser.error("each --source name may only be given once")
+    sources = [replace(source, priority=len(specs) - rank) for rank, source in enumerate(specs)]
+    profiler = StageProfiler(args.profile)
+
+    # Fetch AppStream data
+    with profiler.stage("fetch"):
+        try:
+            source_paths = fetch_sources(sources, arches, args.cache_dir, args.cache_ttl)
+        except Exception as e:
+            print(f"Error fetching AppStream data: {e}")
+            sys.exit(1)
+
+        custom_path = args.custom
+        if custom_path is None and Path(CUSTOM_DATA_FILE).is_file():
+            custom_path = Path(CUSTOM_DATA_FILE)
+        overrides = None
+        if custom_path:
+            try:
+                overrides = OverrideIndex.load(custom_path)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Error reading {custom_path}: {e}")
+                sys.exit(1)
+            overrides.fetch(args.cache_dir, args.cache_ttl, jobs=args.icon_jobs, icons=not args.no_icons)
+
+    # Parse and merge components
+    with profiler.stage("parse") as stage:
+        store = load_component_store(sources, source_paths, arches, args.cache_dir)
+        if overrides:
+            # Override metainfo takes precedence over every source, laid
+            # over the component it replaces where there is one
+            custom_source = AppStreamSource("custom", str(custom_path), priority=len(sources) + 1)
+            override_components = overrides.components()
+            for arch in arches:
+                view = store.views.get(arch, {})
+                overlaid = {
+                    comp_id: overlay_component(view[comp_id], component) if comp_id in view else component
+                    for comp_id, component in override_components.items()
+                }
+                store.add(arch, custom_source, overlaid)
+        arch_components = store.views
+        flathub_components = store.merged()
+        stage.items = len(flathub_components)
 
     # Get nixpkgs packages
-    if args.no_nix_search:
-        nixpkgs_packages = {}
-    else:
-        nixpkgs_packages = scan_nixpkgs_desktop_files()
-
-    # Build desktop ID mapping
-    desktop_id_mapping = build_desktop_id_mapping()
-
-    # Add all mapped attrs to nixpkgs_packages if not present
-    for _desktop_id, attr in desktop_id_mapping.items():
-        if attr not in nixpkgs_packages:
-            nixpkgs_packages[attr] = NixPackage(attr=attr, version="unknown")
+    with profiler.stage("scan") as stage:
+        # The mapping is built from the first architecture's packages; the
+        # other architectures only load which attrs they have
+        system = nix_system(arches[0])
+        if args.packages_json:
+            try:
+                nixpkgs_packages = load_packages_json(args.packages_json, system=system)
+            except (OSError, RuntimeError) as e:
+                print(f"Error reading {args.packages_json}: {e}")
+                sys.exit(1)
+            if args.scan_store:
+                scan_store_desktop_files(nixpkgs_packages, args.cache_dir, jobs=args.scan_jobs)
+        elif args.no_nix_search:
+            nixpkgs_packages = {}
+        else:
+            nixpkgs_packages = scan_nixpkgs_desktop_files(
+                args.nixpkgs,
+                scan_store=args.scan_store,
+                cache_dir=args.cache_dir,
+                jobs=args.scan_jobs,
+                system=system,
+            )
 
-    # Create mappings
-    mappings = create_mapping(flathub_components, nixpkgs_packages, desktop_id_mapping)
+        # Attrs available per architecture; an architecture without an
+        # entry is not filtered
+        arch_attrs = {}
+        if nixpkgs_packages:
+            arch_attrs[arches[0]] = set(nixpkgs_packages)
+        for arch in arches[1:]:
+            if args.packages_json:
+                attrs = set(load_packages_json(args.packages_json, system=nix_system(arch)))
+            elif args.no_nix_search:
+                continue
+            else:
+                attrs = set(scan_nixpkgs_desktop_files(args.nixpkgs, cache_dir=args.cache_dir, system=nix_system(arch)))
+            if attrs:
+                arch_attrs[arch] = attrs
+            else:
+                print(f"Warning: No packages found for {nix_system(arch)}; not filtering its catalog")
+
+        # Correlate desktop IDs from a local nixpkgs checkout
+        if args.nixpkgs:
+            evidence = scan_nixpkgs_source(args.nixpkgs, args.cache_dir, jobs=args.scan_jobs)
+            updated = apply_source_desktop_ids(nixpkgs_packages, evidence)
+            print(f"Attached source-tree desktop IDs to {updated} packages")
+        stage.items = len(nixpkgs_packages)
+
+    with profiler.stage("map") as stage:
+        # Build desktop ID mapping
+        desktop_id_mapping = build_desktop_id_mapping()
+
+        # Add all mapped and overridden attrs to nixpkgs_packages if not present
+        pinned_attrs = [*desktop_id_mapping.values(), *(overrides.by_attr if overrides else ())]
+        for attr in pinned_attrs:
+            if attr not in nixpkgs_packages:
+                nixpkgs_packages[attr] = NixPackage(attr=attr, version="unknown")
+
+        # Create mappings
+        # The report always covers the default threshold; a lower
+        # --min-confidence admits weaker matches as well
+        mappings = create_mapping(
+            flathub_components,
+            nixpkgs_packages,
+            desktop_id_mapping,
+            overrides=overrides,
+            min_score=min(args.min_confidence, MIN_MAPPING_SCORE),
+        )
+        stage.items = len(mappings)
 
     # Generate outputs
     args.output.mkdir(parents=True, exist_ok=True)
 
-    generate_mapping_report(mappings, flathub_components, args.output)
+    with profiler.stage("report") as stage:
+        generate_mapping_report(mappings, flathub_components, args.output)
+        stage.items = len(mappings)
 
     if not args.mapping_only:
-        generate_appstream_catalog(
-            mappings,
-            flathub_components,
-            args.output,
-            download_icons=not args.no_icons,
-        )
+        with profiler.stage("generate") as stage:
+            catalog_mappings = [m for m in mappings if m.confidence >= args.min_confidence]
+            print(f"{len(catalog_mappings)} mappings meet the confidence threshold of {args.min_confidence}")
+            generator = None
+            if args.generator_output:
+                generator = GeneratorIndex.scan(args.generator_output, jobs=args.scan_jobs)
+            # Curated attrs missing from the first architecture's packages were
+            # never checked, so only attrs known there can be ruled out elsewhere
+            known_attrs = arch_attrs.get(arches[0], set())
+            for arch, components in arch_components.items():
+                available = arch_attrs.get(arch)
+                arch_mappings = [
+                    m
+                    for m in catalog_mappings
+                    if m.flathub_id in components
+                    and (available is None or m.nixpkgs_attr in available or m.nixpkgs_attr not in known_attrs)
+                ]
+                if available is not None:
+                    print(f"{arch}: {len(arch_mappings)} mappings have a package on {nix_system(arch)}")
+                # A single architecture keeps the historical flat output layout
+                generate_appstream_catalog(
+                    arch_mappings,
+                    components,
+                    args.output if len(arches) == 1 else args.output / arch,
+                    download_icons=not args.no_icons,
+                    icon_jobs=args.icon_jobs,
+                    write_plain=not args.compressed_only,
+                    fragment_dir=None if args.full_rebuild else args.cache_dir / "fragments" / arch,
+                    jobs=args.jobs,
+                    arch=arch,
+                    generator=generator,
+                    overrides=overrides,
+                )
+            stage.items = len(catalog_mappings)
+
+    if args.profile:
+        profiler.write_report(args.output)
 
     print("\nDone!")
     print(f"Output directory: {args.output}")
@@ -0,0 +1,135 @@
+"""download_cached against a local HTTP stand-in."""
+
+import http.server
+import json
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import flathub_mapper  # noqa: E402
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    """Serves /<name> from the class-level routes table: name -> (status, body, etag)."""
+
+    routes: dict[str, tuple[int, bytes, str | None]] = {}
+    requests: list[tuple[str, str | None]] = []
+
+    def do_GET(self):
+        StandIn.requests.append((self.path, self.headers.get("If-None-Match")))
+        status, body, etag = StandIn.routes.get(self.path, (404, b"missing", None))
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandIn.routes = {}
+    StandIn.requests = []
+    httpd = http.server.HTTPServer(("127.0.0.1", 0), StandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fresh_download_writes_sidecar(server, tmp_path):
+    StandIn.routes["/a"] = (200, b"alpha", '"v1"')
+    dest = flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 24)
+
+    assert dest.read_bytes() == b"alpha"
+    meta = json.loads((tmp_path / "data.meta.json").read_text())
+    assert meta["url"] == f"{server}/a"
+    assert meta["etag"] == '"v1"'
+
+
+def test_within_ttl_makes_no_request(server, tmp_path):
+    StandIn.routes["/a"] = (200, b"alpha", '"v1"')
+    flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 24)
+    flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 24)
+
+    assert len(StandIn.requests) == 1
+
+
+def test_stale_cache_revalidates_with_etag(server, tmp_path):
+    StandIn.routes["/a"] = (200, b"alpha", '"v1"')
+    flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 0)
+    dest = flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 0)
+
+    assert StandIn.requests[-1] == ("/a", '"v1"')
+    assert dest.read_bytes() == b"alpha"
+
+
+def test_changed_resource_is_replaced(server, tmp_path):
+    StandIn.routes["/a"] = (200, b"alpha", '"v1"')
+    flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 0)
+    StandIn.routes["/a"] = (200, b"beta", '"v2"')
+    dest = flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 0)
+
+    assert dest.read_bytes() == b"beta"
+
+
+def test_url_change_within_ttl_refetches(server, tmp_path):
+    StandIn.routes["/a"] = (200, b"alpha", '"v1"')
+    StandIn.routes["/b"] = (200, b"bravo", '"v1"')
+    flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 24)
+    dest = flathub_mapper.download_cached(f"{server}/b", tmp_path / "data", 24)
+
+    assert dest.read_bytes() == b"bravo"
+    # a's validators must not be sent for b
+    assert StandIn.requests[-1] == ("/b", None)
+
+
+def test_http_error_falls_back_to_stale_copy(server, tmp_path):
+    StandIn.routes["/a"] = (200, b"alpha", '"v1"')
+    flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 0)
+    StandIn.routes["/a"] = (404, b"gone", None)
+    dest = flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 0)
+
+    assert dest.read_bytes() == b"alpha"
+
+
+def test_http_error_without_cache_raises(server, tmp_path):
+    with pytest.raises(flathub_mapper.urllib.error.HTTPError):
+        flathub_mapper.download_cached(f"{server}/missing", tmp_path / "data", 24)
+    assert not (tmp_path / "data").exists()
+
+
+def test_unreachable_server_uses_stale_copy(server, tmp_path):
+    StandIn.routes["/a"] = (200, b"alpha", '"v1"')
+    url = f"{server}/a"
+    flathub_mapper.download_cached(url, tmp_path / "data", 0)
+    meta_path = tmp_path / "data.meta.json"
+    meta = json.loads(meta_path.read_text())
+
+    # Point the sidecar at a closed port, as if the server went away
+    dead_url = "http://127.0.0.1:9/a"
+    meta["url"] = dead_url
+    meta_path.write_text(json.dumps(meta))
+    dest = flathub_mapper.download_cached(dead_url, tmp_path / "data", 0)
+
+    assert dest.read_bytes() == b"alpha"
+
+
+def test_stale_copy_of_other_url_is_not_used(server, tmp_path):
+    StandIn.routes["/a"] = (200, b"alpha", '"v1"')
+    flathub_mapper.download_cached(f"{server}/a", tmp_path / "data", 24)
+
+    with pytest.raises(flathub_mapper.urllib.error.HTTPError):
+        flathub_mapper.download_cached(f"{server}/missing", tmp_path / "data", 24)
@@ -0,0 +1,90 @@
+"""IconDownloader honours the proxy environment like urllib."""
+
+import base64
+import http.server
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import flathub_mapper  # noqa: E402
+
+PROXY_VARIABLES = ("http_proxy", "https_proxy", "no_proxy", "HTTP_PROXY", "HTTPS_PROXY", "NO_PROXY")
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    """Answers every GET with a fixed icon, and CONNECT with 403; records what it saw."""
+
+    protocol_version = "HTTP/1.1"
+    requests: list[tuple[str, str, str | None]] = []
+
+    def do_GET(self):
+        StandIn.requests.append(("GET", self.path, self.headers.get("Proxy-Authorization")))
+        body = b"icon"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_CONNECT(self):
+        StandIn.requests.append(("CONNECT", self.path, self.headers.get("Proxy-Authorization")))
+        self.send_response(403)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    for name in PROXY_VARIABLES:
+        monkeypatch.delenv(name, raising=False)
+    StandIn.requests = []
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def download(tmp_path: Path, url: str) -> Path | None:
+    with flathub_mapper.IconDownloader(tmp_path) as downloader:
+        return downloader.submit(url, "a.b.C").result()
+
+
+def test_direct_without_proxy(server, tmp_path):
+    path = download(tmp_path, f"http://{server}/icons/a.png")
+
+    assert path.read_bytes() == b"icon"
+    assert StandIn.requests == [("GET", "/icons/a.png", None)]
+
+
+def test_http_goes_through_proxy(server, tmp_path, monkeypatch):
+    monkeypatch.setenv("http_proxy", f"http://user:p%40ss@{server}")
+    path = download(tmp_path, "http://icons.example/icons/a.png?size=128")
+
+    assert path.read_bytes() == b"icon"
+    credentials = base64.b64encode(b"user:p@ss").decode()
+    assert StandIn.requests == [("GET", "http://icons.example/icons/a.png?size=128", f"Basic {credentials}")]
+
+
+def test_https_is_tunnelled(server, tmp_path, monkeypatch):
+    monkeypatch.setenv("https_proxy", server)
+    with pytest.raises(OSError):
+        flathub_mapper.IconDownloader(tmp_path)._get("https://icons.example/a.png")
+
+    assert StandIn.requests == [("CONNECT", "icons.example:443", None)]
+
+
+def test_no_proxy_bypasses_proxy(server, tmp_path, monkeypatch):
+    monkeypatch.setenv("http_proxy", "http://proxy.invalid:3128")
+    monkeypatch.setenv("no_proxy", "127.0.0.1")
+    path = download(tmp_path, f"http://{server}/a.png")
+
+    assert path.read_bytes() == b"icon"
+    assert StandIn.requests == [("GET", "/a.png", None)]
@@ -0,0 +1,85 @@
+"""iter_component_xml splits catalogs along the parser's own byte offsets."""
+
+import gzip
+import io
+import sys
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import flathub_mapper  # noqa: E402
+
+CATALOG = b"""<?xml version="1.0" encoding="UTF-8"?>
+<components version="0.8" origin="flathub">
+  <!-- <component type="desktop"><id>bogus</id> -->
+  <component type="desktop-application">
+    <id>a.b.C</id>
+    <name>C</name>
+    <description><![CDATA[</component><component type="desktop">]]></description>
+    <icon type="cached" width="128" height="128">a.b.C.png</icon>
+  </component>
+  <component type="runtime">
+    <id>org.freedesktop.Platform</id>
+  </component>
+  <component type="desktop"/>
+  <component type="desktop" >
+    <id>x.y.Z</id>
+    <name>&lt;component&gt; /&gt; Z</name>
+    <summary>Text with /> in it</summary>
+  </component >
+</components>
+"""
+
+
+def split(data: bytes, chunk_size: int, types=None) -> list[bytes]:
+    return list(flathub_mapper.iter_component_xml(io.BytesIO(data), chunk_size, types=types))
+
+
+def test_spans_are_whole_components():
+    spans = split(CATALOG, 4096)
+
+    assert [ET.fromstring(xml).findtext("id") for xml in spans] == [
+        "a.b.C",
+        "org.freedesktop.Platform",
+        None,
+        "x.y.Z",
+    ]
+    assert spans[2] == b'<component type="desktop"/>'
+    assert spans[3].endswith(b"</component >")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 13, 64])
+def test_chunk_size_does_not_change_spans(chunk_size):
+    assert split(CATALOG, chunk_size) == split(CATALOG, 4096)
+
+
+def test_comments_and_cdata_are_not_tags():
+    spans = split(CATALOG, 5)
+
+    assert b"bogus" not in b"".join(spans)
+    assert ET.fromstring(spans[0]).findtext("description") == '</component><component type="desktop">'
+
+
+def test_types_filter_skips_other_components():
+    spans = split(CATALOG, 7, types=flathub_mapper.DESKTOP_TYPES)
+
+    assert [ET.fromstring(xml).findtext("id") for xml in spans] == ["a.b.C", None, "x.y.Z"]
+
+
+def test_malformed_catalog_raises_parse_error():
+    with pytest.raises(ET.ParseError):
+        split(CATALOG.replace(b"</components>", b""), 4096)
+
+
+def test_parse_flathub_appstream_keeps_component_after_comment(tmp_path):
+    path = tmp_path / "appstream.xml.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(CATALOG)
+
+    components = flathub_mapper.parse_flathub_appstream(path, "https://icons.example")
+
+    assert sorted(components) == ["a.b.C", "x.y.Z"]
+    assert components["a.b.C"].icon_url == "https://icons.example/128x128/a.b.C.png"